@@ -1,12 +1,21 @@
 import os
+import threading
+import time
+from concurrent.futures import wait
 
 from flask import Flask, jsonify, render_template, request
 from flask_cors import CORS
 
-from cache import cache
+from cache import cache, negative_cache
 from config import Config
 from services import get_service, get_unique_services
+from utils.breaker import get_breaker_stats
+from utils.executor import get_executor
+from utils.html import resolution_cache
+from utils.http import VALIDATORS, UpstreamError, get_pool_stats
+from utils.ratelimit import configure_rate_limits, get_rate_limit_stats
 from utils.response import format_error_response, format_response
+from utils.singleflight import SingleFlight
 from utils.validation import get_request_params, validate_username
 
 # Create a default avatar image directory
@@ -15,6 +24,164 @@ os.makedirs("utils", exist_ok=True)
 app = Flask(__name__, template_folder="templates")
 CORS(app)
 
+# Redis-backed caches also coalesce upstream fetches across workers
+flights = SingleFlight(getattr(cache, "redis", None) if Config.SINGLEFLIGHT_DISTRIBUTED else None)
+
+# Redis-backed caches also share upstream rate limits across workers
+if Config.RATE_LIMIT_DISTRIBUTED:
+    configure_rate_limits(getattr(cache, "redis", None), getattr(cache, "get_async_redis", None))
+
+# Keys with a background refresh queued or running in this worker
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+
+def fetch_profile_picture(service_adapter, service, username, ttl=None, stale=None):
+    """
+    Resolve an avatar URL from upstream and cache it, once per key across concurrent callers.
+
+    Only the URL is fetched; the image is downloaded by ``fetch_image`` when a
+    request needs it. When refreshing a stale entry its image bytes are checked
+    with a conditional request and kept if the upstream reports them unchanged.
+
+    Args:
+        service_adapter (AvatarProvider): The service adapter
+        service (str): The service name
+        username (str): The username to get the profile picture for
+        ttl (int, optional): Custom TTL in seconds
+        stale (dict, optional): The stale entry being refreshed, as read by the caller
+
+    Returns:
+        tuple: (image_data, image_url, error)
+    """
+    cache_key = f"{service}:{username}"
+
+    def fetch():
+        _, image_url, error = service_adapter.get_profile_picture(username, with_image=False)
+        if error:
+            # A refusal by this worker's own breaker or rate limiter says nothing about the user
+            if not getattr(error, "local", False):
+                negative_cache.set(cache_key, getattr(error, "status_code", None), error)
+            return None, None, error
+
+        if stale and stale.get("image_url") == image_url and stale.get("image_data"):
+            entry = revalidate_image(service_adapter, stale)
+        else:
+            entry = {"image_data": None, "image_url": image_url}
+
+        cache.set(cache_key, entry, ttl)
+        return entry["image_data"], image_url, None
+
+    def check():
+        cached_data = cache.get(cache_key)
+        if cached_data:
+            return cached_data.get("image_data"), cached_data.get("image_url"), None
+
+        failure = negative_cache.get(cache_key)
+        if failure:
+            return None, None, failure["error"]
+
+        return None
+
+    return flights.do(cache_key, fetch, check)
+
+
+def revalidate_image(service_adapter, cached_data):
+    """
+    Check a cached image against upstream with the validators it was downloaded with.
+
+    A 304 Not Modified keeps the cached bytes, so refreshing an unchanged
+    avatar costs a header round-trip instead of a download. Images cached
+    without validators are dropped and downloaded again when a request needs them.
+
+    Args:
+        service_adapter (AvatarProvider): The service adapter
+        cached_data (dict): The cached entry, holding the image of its URL
+
+    Returns:
+        dict: The entry to cache, its image data is None if it has to be downloaded again
+    """
+    image_url = cached_data["image_url"]
+    validators = {field: cached_data[field] for field in VALIDATORS if cached_data.get(field)}
+    if not validators:
+        return {"image_data": None, "image_url": image_url}
+
+    try:
+        image_data, new_validators, not_modified = service_adapter.download_image_conditional(image_url, validators)
+    except UpstreamError:
+        # Keep the image we have until the upstream is back
+        return {"image_data": cached_data["image_data"], "image_url": image_url, **validators}
+
+    if not_modified:
+        return {"image_data": cached_data["image_data"], "image_url": image_url, **validators, **new_validators}
+    return {"image_data": image_data, "image_url": image_url, **new_validators}
+
+
+def fetch_image(service_adapter, service, username, image_url, ttl=None):
+    """
+    Download the image of a resolved avatar URL and cache it, once per key across concurrent callers.
+
+    Args:
+        service_adapter (AvatarProvider): The service adapter
+        service (str): The service name
+        username (str): The username the avatar belongs to
+        image_url (str): The resolved avatar URL
+        ttl (int, optional): Custom TTL in seconds
+
+    Returns:
+        bytes: The image data or None if it could not be downloaded
+    """
+    cache_key = f"{service}:{username}"
+
+    def fetch():
+        try:
+            image_data, validators, _ = service_adapter.download_image_conditional(image_url)
+        except UpstreamError:
+            return None
+
+        if image_data:
+            cache.set(cache_key, {"image_data": image_data, "image_url": image_url, **validators}, ttl)
+        return image_data
+
+    def check():
+        cached_data = cache.get(cache_key)
+        if cached_data and cached_data.get("image_url") == image_url:
+            return cached_data.get("image_data")
+        return None
+
+    return flights.do(f"{cache_key}:image", fetch, check)
+
+
+def refresh_profile_picture(service_adapter, service, username, ttl=None, stale=None):
+    """
+    Refresh a stale cache entry in the background, at most once at a time per key.
+
+    The stale entry keeps being served until the refresh stores a new one;
+    if the refresh fails it stays until its grace window ends.
+
+    Args:
+        service_adapter (AvatarProvider): The service adapter
+        service (str): The service name
+        username (str): The username to refresh the profile picture for
+        ttl (int, optional): Custom TTL in seconds
+        stale (dict, optional): The stale entry being served
+    """
+    cache_key = f"{service}:{username}"
+
+    with refreshing_lock:
+        if cache_key in refreshing:
+            return
+        refreshing.add(cache_key)
+
+    def refresh():
+        try:
+            fetch_profile_picture(service_adapter, service, username, ttl, stale)
+        finally:
+            with refreshing_lock:
+                refreshing.discard(cache_key)
+
+    get_executor().submit(refresh)
+
 
 @app.route("/")
 def index():
@@ -71,28 +238,36 @@ def get_profile_picture(service, username):
         return error_response
 
     cache_key = f"{service}:{username}"
-    cached_data = cache.get(cache_key)
-    cache_metadata = None
+    cached_data, cache_metadata = cache.get_with_metadata(cache_key)
 
     if cached_data:
-        cache_metadata = cache.get_metadata(cache_key)
-        return format_response(
-            username,
-            service,
-            cached_data.get("image_data"),
-            cached_data.get("image_url"),
-            cache_metadata,
-            raw,
-        )
-
-    image_data, image_url, error = service_adapter.get_profile_picture(username)
+        if cache_metadata and cache_metadata["status"] == "stale":
+            refresh_profile_picture(service_adapter, service, username, ttl, cached_data)
+
+        image_data = cached_data.get("image_data")
+        image_url = cached_data.get("image_url")
+        # Set when the image bytes come from the blob store, see DedupCache
+        image_hash = cached_data.get("image_hash") if image_data else None
+
+        # Entries resolved by raw or batch requests hold only the URL
+        if not raw and image_data is None and image_url:
+            image_data = fetch_image(service_adapter, service, username, image_url, ttl)
+
+        return format_response(username, service, image_data, image_url, cache_metadata, raw, ttl, image_hash)
+
+    failure = negative_cache.get(cache_key)
+    if failure:
+        return format_error_response(404, failure["error"])
+
+    image_data, image_url, error = fetch_profile_picture(service_adapter, service, username, ttl)
 
     if error:
         return format_error_response(404, error)
 
-    cache.set(cache_key, {"image_data": image_data, "image_url": image_url}, ttl)
+    if not raw and image_data is None and image_url:
+        image_data = fetch_image(service_adapter, service, username, image_url, ttl)
 
-    return format_response(username, service, image_data, image_url, None, raw)
+    return format_response(username, service, image_data, image_url, None, raw, ttl)
 
 
 @app.route("/batch")
@@ -105,8 +280,11 @@ def batch_profile_pictures():
         raw (bool): If true, return JSON data
 
     Returns:
-        JSON response with all requested profile pictures
+        JSON response with all requested profile pictures, services not resolved
+        within BATCH_DEADLINE come back with a "timeout" status
     """
+    deadline = time.monotonic() + Config.BATCH_DEADLINE / 1000
+
     _, ttl, error_response = get_request_params()
     if error_response:
         return error_response
@@ -122,6 +300,7 @@ def batch_profile_pictures():
         return format_error_response(400, "No service-username pairs provided")
 
     results = {}
+    pending = {}
     for service, username in service_usernames.items():
         service_adapter = get_service(service)
         if not service_adapter:
@@ -133,17 +312,30 @@ def batch_profile_pictures():
             results[service] = {"error": error_message}
             continue
 
-        cache_key = f"{service}:{username}"
-        cached_data = cache.get(cache_key)
-        cache_metadata = None
+        pending[service] = (service_adapter, username)
+
+    # One cache round-trip for every key before any upstream work starts
+    cached = cache.get_many_with_metadata([f"{service}:{username}" for service, (_, username) in pending.items()])
+
+    # Failures are only looked up for the keys that missed
+    misses = [
+        f"{service}:{username}" for service, (_, username) in pending.items() if not cached[f"{service}:{username}"][0]
+    ]
+    failures = negative_cache.get_many(misses) if misses else {}
+
+    futures = {}
+    for service, (service_adapter, username) in pending.items():
+        cached_data, cache_metadata = cached[f"{service}:{username}"]
 
         if cached_data:
-            cache_metadata = cache.get_metadata(cache_key)
             image_url = cached_data.get("image_url")
             if not image_url:
                 results[service] = {"error": f"Avatar not found for {username} on {service}"}
                 continue
 
+            if cache_metadata and cache_metadata["status"] == "stale":
+                refresh_profile_picture(service_adapter, service, username, ttl, cached_data)
+
             results[service] = {
                 "username": username,
                 "service": service,
@@ -152,7 +344,33 @@ def batch_profile_pictures():
             }
             continue
 
-        image_data, image_url, error = service_adapter.get_profile_picture(username)
+        failure = failures.get(f"{service}:{username}")
+        if failure:
+            results[service] = {"error": failure["error"], "cache": {"status": "negative"}}
+            continue
+
+        future = get_executor().submit(fetch_profile_picture, service_adapter, service, username, ttl)
+        futures[future] = service
+
+    # Fetches still running at the deadline keep going and cache their result for the next request
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+    for future in not_done:
+        service = futures[future]
+        results[service] = {
+            "error": f"Timed out fetching avatar for {pending[service][1]} on {service}",
+            "status": "timeout",
+        }
+
+    for future in done:
+        service = futures[future]
+        username = pending[service][1]
+
+        try:
+            _, image_url, error = future.result()
+        except Exception as e:
+            results[service] = {"error": str(e)}
+            continue
 
         if error:
             results[service] = {"error": error}
@@ -162,8 +380,6 @@ def batch_profile_pictures():
             results[service] = {"error": f"Avatar not found for {username} on {service}"}
             continue
 
-        cache.set(cache_key, {"image_data": image_data, "image_url": image_url}, ttl)
-
         results[service] = {
             "username": username,
             "service": service,
@@ -179,23 +395,41 @@ def health_check():
     """
     Health check endpoint.
 
+    The status is "degraded" while any upstream service's circuit breaker in
+    this worker is not closed; the endpoint still answers 200 since cached
+    avatars and other services keep being served.
+
     Returns:
-        JSON response with service status
+        JSON response with service status and breaker state per upstream service
     """
-    return jsonify({"status": "ok", "version": "1.0.0"})
+    breakers = {name: stats["state"] for name, stats in get_breaker_stats().items()}
+    status = "ok" if all(state == "closed" for state in breakers.values()) else "degraded"
+
+    return jsonify({"status": status, "version": "1.0.0", "breakers": breakers})
 
 
 @app.route("/stats")
 def get_stats():
     """
-    Get cache statistics.
+    Get cache and upstream connection pool statistics.
 
     Returns:
-        JSON response with cache statistics
+        JSON response with cache statistics and this worker's HTTP pool, coalescing,
+        breaker, rate limit and resolution cache statistics
     """
     stats = cache.get_stats()
 
-    return jsonify({"cache": {"type": Config.CACHE_TYPE, "stats": stats}})
+    return jsonify(
+        {
+            "cache": {"type": Config.CACHE_TYPE, "stats": stats},
+            "http": get_pool_stats(),
+            "negative_cache": negative_cache.get_stats(),
+            "singleflight": flights.get_stats(),
+            "breakers": get_breaker_stats(),
+            "rate_limits": get_rate_limit_stats(),
+            "resolution_cache": resolution_cache.get_stats(),
+        }
+    )
 
 
 @app.route("/invalidate-cache/<service>/<username>")
@@ -220,6 +454,7 @@ def invalidate_cache(service, username):
 
     cache_key = f"{service}:{username}"
     success = cache.delete(cache_key)
+    success = negative_cache.delete(cache_key) or success
 
     if success:
         return jsonify({"status": "ok", "message": f"Cache invalidated for {service}:{username}"})
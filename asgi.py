@@ -0,0 +1,317 @@
+"""
+ASGI entry point.
+
+Profile picture requests are served natively with asyncio: the upstream
+fetches use the shared async HTTP client and Redis-backed caches use
+redis.asyncio, so one worker keeps thousands of cache misses in flight.
+Every other route is the Flask app behind an ASGI-to-WSGI adapter.
+
+Run with ``uvicorn asgi:app`` or ``gunicorn asgi:app -k uvicorn.workers.UvicornWorker``.
+"""
+
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.test import EnvironBuilder
+
+from app import app as flask_app
+from cache import cache, negative_cache
+from config import Config
+from services import get_async_service
+from utils.http import VALIDATORS, UpstreamError, close_async_client
+from utils.response import format_error_response, format_response
+from utils.singleflight import AsyncSingleFlight
+from utils.validation import get_request_params, validate_username
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+flights = AsyncSingleFlight(
+    getattr(cache, "get_async_redis", None) if Config.SINGLEFLIGHT_DISTRIBUTED else None,
+)
+
+# Background refresh tasks by cache key, also keeping them from being garbage collected
+refreshing = {}
+
+
+async def fetch_profile_picture(service_adapter, service, username, ttl=None, stale=None):
+    """
+    Resolve an avatar URL from upstream and cache it, once per key across concurrent callers.
+
+    Only the URL is fetched, see the Flask ``fetch_profile_picture``.
+
+    Args:
+        service_adapter (AsyncAvatarProvider): The async service adapter
+        service (str): The service name
+        username (str): The username to get the profile picture for
+        ttl (int, optional): Custom TTL in seconds
+        stale (dict, optional): The stale entry being refreshed, as read by the caller
+
+    Returns:
+        tuple: (image_data, image_url, error)
+    """
+    cache_key = f"{service}:{username}"
+
+    async def fetch():
+        _, image_url, error = await service_adapter.get_profile_picture(username, with_image=False)
+        if error:
+            if not getattr(error, "local", False):
+                await negative_cache.aset(cache_key, getattr(error, "status_code", None), error)
+            return None, None, error
+
+        if stale and stale.get("image_url") == image_url and stale.get("image_data"):
+            entry = await revalidate_image(service_adapter, stale)
+        else:
+            entry = {"image_data": None, "image_url": image_url}
+
+        await cache.aset(cache_key, entry, ttl)
+        return entry["image_data"], image_url, None
+
+    async def check():
+        cached_data = await cache.aget(cache_key)
+        if cached_data:
+            return cached_data.get("image_data"), cached_data.get("image_url"), None
+
+        failure = await negative_cache.aget(cache_key)
+        if failure:
+            return None, None, failure["error"]
+
+        return None
+
+    return await flights.do(cache_key, fetch, check)
+
+
+async def revalidate_image(service_adapter, cached_data):
+    """
+    Async variant of the Flask ``revalidate_image``.
+
+    Args:
+        service_adapter (AsyncAvatarProvider): The async service adapter
+        cached_data (dict): The cached entry, holding the image of its URL
+
+    Returns:
+        dict: The entry to cache, its image data is None if it has to be downloaded again
+    """
+    image_url = cached_data["image_url"]
+    validators = {field: cached_data[field] for field in VALIDATORS if cached_data.get(field)}
+    if not validators:
+        return {"image_data": None, "image_url": image_url}
+
+    try:
+        image_data, new_validators, not_modified = await service_adapter.download_image_conditional(
+            image_url, validators
+        )
+    except UpstreamError:
+        # Keep the image we have until the upstream is back
+        return {"image_data": cached_data["image_data"], "image_url": image_url, **validators}
+
+    if not_modified:
+        return {"image_data": cached_data["image_data"], "image_url": image_url, **validators, **new_validators}
+    return {"image_data": image_data, "image_url": image_url, **new_validators}
+
+
+async def fetch_image(service_adapter, service, username, image_url, ttl=None):
+    """
+    Download the image of a resolved avatar URL and cache it, once per key across concurrent callers.
+
+    Args:
+        service_adapter (AsyncAvatarProvider): The async service adapter
+        service (str): The service name
+        username (str): The username the avatar belongs to
+        image_url (str): The resolved avatar URL
+        ttl (int, optional): Custom TTL in seconds
+
+    Returns:
+        bytes: The image data or None if it could not be downloaded
+    """
+    cache_key = f"{service}:{username}"
+
+    async def fetch():
+        try:
+            image_data, validators, _ = await service_adapter.download_image_conditional(image_url)
+        except UpstreamError:
+            return None
+
+        if image_data:
+            await cache.aset(cache_key, {"image_data": image_data, "image_url": image_url, **validators}, ttl)
+        return image_data
+
+    async def check():
+        cached_data = await cache.aget(cache_key)
+        if cached_data and cached_data.get("image_url") == image_url:
+            return cached_data.get("image_data")
+        return None
+
+    return await flights.do(f"{cache_key}:image", fetch, check)
+
+
+def refresh_profile_picture(service_adapter, service, username, ttl=None, stale=None):
+    """
+    Refresh a stale cache entry in a background task, at most once at a time per key.
+
+    Args:
+        service_adapter (AsyncAvatarProvider): The async service adapter
+        service (str): The service name
+        username (str): The username to refresh the profile picture for
+        ttl (int, optional): Custom TTL in seconds
+        stale (dict, optional): The stale entry being served
+    """
+    cache_key = f"{service}:{username}"
+    if cache_key in refreshing:
+        return
+
+    def finish(task):
+        refreshing.pop(cache_key, None)
+        if not task.cancelled():
+            task.exception()
+
+    task = asyncio.ensure_future(fetch_profile_picture(service_adapter, service, username, ttl, stale))
+    refreshing[cache_key] = task
+    task.add_done_callback(finish)
+
+
+async def get_profile_picture(service_adapter, service, username):
+    """
+    Async counterpart of the ``/<service>/<username>`` Flask view.
+
+    Runs inside a Flask request context, so validation and response
+    formatting are shared with the sync app.
+
+    Args:
+        service_adapter (AsyncAvatarProvider): The async service adapter
+        service (str): The service name
+        username (str): The username to get the profile picture for
+
+    Returns:
+        Response: Image or JSON response
+    """
+    is_valid, error_message = validate_username(username, service)
+    if not is_valid:
+        return format_error_response(400, error_message)
+
+    raw, ttl, error_response = get_request_params()
+    if error_response:
+        return error_response
+
+    cache_key = f"{service}:{username}"
+    cached_data, cache_metadata = await cache.aget_with_metadata(cache_key)
+
+    if cached_data:
+        if cache_metadata and cache_metadata["status"] == "stale":
+            refresh_profile_picture(service_adapter, service, username, ttl, cached_data)
+
+        image_data = cached_data.get("image_data")
+        image_url = cached_data.get("image_url")
+        # Set when the image bytes come from the blob store, see DedupCache
+        image_hash = cached_data.get("image_hash") if image_data else None
+
+        if not raw and image_data is None and image_url:
+            image_data = await fetch_image(service_adapter, service, username, image_url, ttl)
+
+        return format_response(username, service, image_data, image_url, cache_metadata, raw, ttl, image_hash)
+
+    failure = await negative_cache.aget(cache_key)
+    if failure:
+        return format_error_response(404, failure["error"])
+
+    image_data, image_url, error = await fetch_profile_picture(service_adapter, service, username, ttl)
+
+    if error:
+        return format_error_response(404, error)
+
+    if not raw and image_data is None and image_url:
+        image_data = await fetch_image(service_adapter, service, username, image_url, ttl)
+
+    return format_response(username, service, image_data, image_url, None, raw, ttl)
+
+
+def match_profile_picture(scope):
+    """
+    Match a request against the ``/<service>/<username>`` route.
+
+    Args:
+        scope (dict): The ASGI connection scope
+
+    Returns:
+        tuple: (service_adapter, service, username) or None if another route should handle it
+    """
+    if scope["method"] != "GET":
+        return None
+
+    parts = scope["path"].strip("/").split("/")
+    if len(parts) != 2 or not all(parts):
+        return None
+
+    service, username = parts
+    service_adapter = get_async_service(service)
+    if not service_adapter:
+        return None
+
+    return service_adapter, service, username
+
+
+async def send_response(send, response):
+    """
+    Send a Flask response over ASGI.
+
+    The body is streamed chunk by chunk, which also covers ``send_file``
+    responses that pass their file through instead of buffering it.
+
+    Args:
+        send (callable): The ASGI send channel
+        response (Response): The finalized Flask response
+    """
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    try:
+        for chunk in response.iter_encoded():
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        response.close()
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    """Handle ASGI lifespan events, closing async connections on shutdown."""
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_client()
+            await cache.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application.
+
+    Args:
+        scope (dict): The ASGI connection scope
+        receive (callable): The ASGI receive channel
+        send (callable): The ASGI send channel
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    match = match_profile_picture(scope) if scope["type"] == "http" else None
+    if match is None:
+        await wsgi_app(scope, receive, send)
+        return
+
+    environ = EnvironBuilder(
+        path=scope["path"],
+        query_string=scope["query_string"].decode("latin-1"),
+        headers=[(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]],
+    ).get_environ()
+
+    with flask_app.request_context(environ):
+        response = await get_profile_picture(*match)
+        response = flask_app.process_response(flask_app.make_response(response))
+
+    await send_response(send, response)
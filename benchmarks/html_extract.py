@@ -0,0 +1,171 @@
+"""
+Benchmark avatar URL extraction: full BeautifulSoup parse against the streaming extractor.
+
+The saved profile page fixtures in benchmarks/fixtures are served from a local
+HTTP server, so the end-to-end numbers include reading the response. Bytes and
+peak memory are measured on the parse alone.
+
+Usage:
+    python -m benchmarks.html_extract [--iterations N]
+"""
+
+import argparse
+import os
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+
+from utils.html import (
+    HTML_CHUNK_SIZE,
+    AvatarExtractor,
+    find_avatar_url,
+    get_html,
+    get_image_from_selector,
+    get_meta_content,
+    resolution_cache,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# What each service's adapter looks for on its profile page
+TARGETS = {
+    "youtube": {"meta_property": "og:image"},
+    "twitter": {"meta_property": "og:image"},
+    "instagram": {"meta_property": "og:image"},
+    "reddit": {"img_alt": "avatar"},
+}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serve a fixture page in chunks, like a real upstream."""
+
+    def do_GET(self):
+        path = os.path.join(FIXTURES_DIR, os.path.basename(self.path) + ".html")
+        with open(path, "rb") as f:
+            body = f.read()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        try:
+            for offset in range(0, len(body), HTML_CHUNK_SIZE):
+                self.wfile.write(body[offset : offset + HTML_CHUNK_SIZE])
+        except (BrokenPipeError, ConnectionResetError):
+            # The streaming extractor hung up once it had the avatar
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def soup_avatar_url(soup, meta_property=None, img_alt=None):
+    """Extract the avatar URL from a parsed page the way the adapters used to."""
+    if meta_property:
+        return get_meta_content(soup, meta_property)
+    return get_image_from_selector(soup, f'img[alt*="{img_alt}"]')
+
+
+def full_lookup(url, target):
+    """Fetch and parse the whole page, the get_html path."""
+    soup, _ = get_html(url)
+    return soup_avatar_url(soup, **target)
+
+
+def parse_full(html, target):
+    """Parse a page the get_html way."""
+    return soup_avatar_url(BeautifulSoup(html.decode("utf-8"), "html.parser"), **target), len(html)
+
+
+def parse_streaming(html, target):
+    """Feed a page to the extractor until it has the avatar, as find_avatar_url does."""
+    extractor = AvatarExtractor(**target)
+    for offset in range(0, len(html), HTML_CHUNK_SIZE):
+        if extractor.feed_bytes(html[offset : offset + HTML_CHUNK_SIZE]):
+            break
+    else:
+        extractor.feed_bytes(b"", final=True)
+    return extractor.avatar_url, extractor.size
+
+
+def time_calls(func, iterations):
+    """
+    Time a function.
+
+    Args:
+        func (callable): The function to call
+        iterations (int): Number of calls to time
+
+    Returns:
+        float: Mean latency per call in milliseconds
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def peak_memory(func):
+    """
+    Measure the peak memory allocated by one call.
+
+    Args:
+        func (callable): The function to call
+
+    Returns:
+        int: Peak allocated bytes
+    """
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20, help="number of lookups per fixture and mode")
+    args = parser.parse_args()
+
+    # Every lookup should reach the server
+    resolution_cache.ttl = 0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"{args.iterations} lookups per fixture and mode")
+    print(f"{'fixture':>10} {'mode':>9} {'ms/lookup':>10} {'parse ms':>9} {'bytes read':>11} {'peak KB':>8}")
+
+    for name, target in TARGETS.items():
+        with open(os.path.join(FIXTURES_DIR, f"{name}.html"), "rb") as f:
+            html = f.read()
+
+        url = f"{base_url}/{name}"
+        modes = (
+            ("full", lambda: full_lookup(url, target), lambda: parse_full(html, target)),
+            ("streaming", lambda: find_avatar_url(url, **target), lambda: parse_streaming(html, target)),
+        )
+
+        results = set()
+        for mode, lookup, parse in modes:
+            results.add(lookup())
+            latency = time_calls(lookup, args.iterations)
+            parse_latency = time_calls(parse, args.iterations)
+            avatar_url, size = parse()
+            results.add(avatar_url)
+            peak = peak_memory(parse) // 1024
+            print(f"{name:>10} {mode:>9} {latency:10.2f} {parse_latency:9.2f} {size:11d} {peak:8d}")
+
+        if len(results) != 1:
+            print(f"{name:>10} MISMATCH: {sorted(map(str, results))}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
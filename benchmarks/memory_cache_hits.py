@@ -0,0 +1,62 @@
+"""
+Benchmark MemoryCache hit latency with raw and base64 storage.
+
+Usage:
+    python -m benchmarks.memory_cache_hits [--size BYTES] [--iterations N]
+"""
+
+import argparse
+import os
+import time
+
+from flask import Flask
+
+from cache.memory_cache import MemoryCache
+from utils.response import format_image_response
+
+
+def time_hits(cache, key, iterations, app):
+    """
+    Time cache hits served through format_image_response.
+
+    Args:
+        cache (MemoryCache): The cache to read from
+        key (str): The cached key
+        iterations (int): Number of hits to time
+        app (Flask): App providing the request context
+
+    Returns:
+        float: Mean latency per hit in microseconds
+    """
+    with app.test_request_context():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            cached_data = cache.get(key)
+            response = format_image_response(cached_data.get("image_data"))
+            b"".join(response.response)
+        elapsed = time.perf_counter() - start
+
+    return elapsed / iterations * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=64 * 1024, help="image size in bytes")
+    parser.add_argument("--iterations", type=int, default=5000, help="number of cache hits per mode")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    image_data = os.urandom(args.size)
+    value = {"image_data": image_data, "image_url": "https://example.com/avatar.png"}
+
+    print(f"image size: {args.size} bytes, {args.iterations} hits per mode")
+    for label, store_raw in (("base64", False), ("raw", True)):
+        cache = MemoryCache(store_raw=store_raw)
+        cache.set("github:octocat", value)
+        latency = time_hits(cache, "github:octocat", args.iterations, app)
+        resident = cache.get_stats()["bytes"]
+        print(f"{label:>6}: {latency:8.1f} us/hit, {resident} resident bytes")
+
+
+if __name__ == "__main__":
+    main()
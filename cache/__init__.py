@@ -1,12 +1,28 @@
+from cache.dedup_cache import DedupCache
 from cache.memory_cache import MemoryCache
+from cache.negative_cache import NegativeCache
 from cache.redis_cache import RedisCache
+from cache.shared_cache import SharedMemoryCache
+from cache.tiered_cache import TieredCache
 from config import Config
 
 
-def get_cache():
+def get_backend():
     if Config.CACHE_TYPE == "redis":
         return RedisCache()
+    if Config.CACHE_TYPE == "tiered":
+        return TieredCache()
+    if Config.CACHE_TYPE == "shared":
+        return SharedMemoryCache()
     return MemoryCache()
 
 
+def get_cache():
+    backend = get_backend()
+    if Config.CACHE_DEDUP:
+        return DedupCache(backend)
+    return backend
+
+
 cache = get_cache()
+negative_cache = NegativeCache(getattr(cache, "redis", None), getattr(cache, "get_async_redis", None))
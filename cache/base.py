@@ -0,0 +1,280 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from cache.utils import get_blob_key
+
+
+class BaseCache(ABC):
+    """
+    Base class for all cache backends.
+
+    Backends implement single-key operations; the batch helpers fall back to
+    looping over them and should be overridden where the backend can do a
+    whole batch in one round-trip. The async helpers used by the ASGI entry
+    point call the sync methods directly, which is fine for in-process
+    backends; network backends override them.
+    """
+
+    @abstractmethod
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata in a single lookup.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set a value in the cache.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """
+        Delete a value from the cache.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            bool: True if deleted, False if not found
+        """
+        pass
+
+    @abstractmethod
+    def delete_pattern(self, pattern: str) -> int:
+        """
+        Delete all keys matching a pattern.
+
+        Args:
+            pattern: The pattern to match
+
+        Returns:
+            int: Number of keys deleted
+        """
+        pass
+
+    @abstractmethod
+    def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get metadata for a cached item.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: Metadata or None if not found
+        """
+        pass
+
+    @abstractmethod
+    def clear(self) -> bool:
+        """
+        Clear all cache data.
+
+        Returns:
+            bool: True if successful
+        """
+        pass
+
+    @abstractmethod
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dict[str, Any]: Cache statistics
+        """
+        pass
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a value from the cache.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: The cached value or None if not found
+        """
+        return self.get_with_metadata(key)[0]
+
+    def get_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        return {key: self.get_with_metadata(key) for key in keys}
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get values for several keys.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to its value or None if not found
+        """
+        return {key: value for key, (value, _) in self.get_many_with_metadata(keys).items()}
+
+    def peek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys without counting them in the hit and miss statistics.
+
+        Used for entries read on behalf of another lookup, like image blobs.
+        Backends that count hits override it.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        return self.get_many_with_metadata(keys)
+
+    def get_with_blob(
+        self, key: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata along with the blob its ``image_hash`` refers to.
+
+        Only the value counts in the hit and miss statistics.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata, blob), the blob is None if the value has none or it is missing
+        """
+        value, metadata = self.get_with_metadata(key)
+        blob_key = get_blob_key(value)
+        if blob_key is None:
+            return value, metadata, None
+
+        return value, metadata, self.peek_many_with_metadata([blob_key])[blob_key][0]
+
+    def get_metadata_many(self, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get metadata for several keys.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to its metadata or None if not found
+        """
+        return {key: self.get_metadata(key) for key in keys}
+
+    def set_many(self, values: Dict[str, Dict[str, Any]], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set several values with the same TTL.
+
+        Args:
+            values: Maps cache keys to the values to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if every value was stored
+        """
+        results = [self.set(key, value, ttl) for key, value in values.items()]
+        return all(results)
+
+    async def aget_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Async variant of get_with_metadata.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        return self.get_with_metadata(key)
+
+    async def apeek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Async variant of peek_many_with_metadata.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        return self.peek_many_with_metadata(keys)
+
+    async def aget_with_blob(
+        self, key: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Async variant of get_with_blob.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata, blob), the blob is None if the value has none or it is missing
+        """
+        value, metadata = await self.aget_with_metadata(key)
+        blob_key = get_blob_key(value)
+        if blob_key is None:
+            return value, metadata, None
+
+        return value, metadata, (await self.apeek_many_with_metadata([blob_key]))[blob_key][0]
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Async variant of get.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: The cached value or None if not found
+        """
+        return (await self.aget_with_metadata(key))[0]
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Async variant of set.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        return self.set(key, value, ttl)
+
+    async def aclose(self) -> None:
+        """Close async connections opened by the async helpers."""
+        pass
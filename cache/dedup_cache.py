@@ -0,0 +1,365 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from cache.base import BaseCache
+from cache.utils import BLOB_PREFIX, get_blob_key, get_ttl
+from config import Config
+
+# Blob hashes this worker remembers writing, so unchanged images are not rewritten
+MAX_TRACKED_BLOBS = 10000
+
+# Blobs live this much longer than the entry they are written for, up to CACHE_TTL_MAX,
+# so entries stored within that margin reuse the blob instead of writing it again
+BLOB_TTL_MARGIN = 0.25
+
+
+class DedupCache(BaseCache):
+    """
+    Content-addressed image storage in front of another cache backend.
+
+    Every entry is split into a small pointer record under its own key (image
+    URL, ``image_hash`` and other fields) and the image bytes under
+    ``blob:<sha256>``, shared by all entries with the same image.
+
+    Blobs are garbage collected by expiry rather than reference counts: a blob
+    is written again whenever it would expire before the pointer being
+    written, so it outlives every pointer to it. When the backend refuses a
+    blob, the entry is stored whole instead of as a pointer to nothing.
+
+    Reads fetch a pointer and then the blob it names, and only the pointer
+    counts as a hit or miss. If a blob is evicted early anyway, entries
+    come back without image bytes and the image is downloaded again on demand.
+    """
+
+    def __init__(self, backend: BaseCache):
+        """
+        Initialize the dedup layer.
+
+        Args:
+            backend: The cache backend storing pointers and blobs
+        """
+        self.backend = backend
+        self.redis = getattr(backend, "redis", None)
+        self.get_async_redis = getattr(backend, "get_async_redis", None)
+        self.written = OrderedDict()
+        self.stats = {"image_writes": 0, "blob_writes": 0, "image_bytes": 0, "blob_bytes": 0, "missing_blobs": 0}
+        self.lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.Lock()
+
+    def _split(
+        self, value: Dict[str, Any], ttl: Optional[Union[int, str]]
+    ) -> Tuple[Dict[str, Any], Optional[Tuple[str, bytes, int]]]:
+        """
+        Split a value into its pointer record and the blob that still has to be written.
+
+        Call ``_written`` once the blob is stored, so later entries can skip writing it.
+
+        Args:
+            value: The value to cache
+            ttl: Time to live of the entry in seconds
+
+        Returns:
+            Tuple: (pointer, (image hash, image bytes, blob TTL) or None if no write is needed)
+        """
+        image_data = value.get("image_data")
+        if not isinstance(image_data, (bytes, bytearray, memoryview)) or not image_data:
+            return value, None
+
+        image_hash = hashlib.sha256(image_data).hexdigest()
+        pointer = {**value, "image_data": None, "image_hash": image_hash}
+        ttl = get_ttl(ttl)
+        # The backend would reset a TTL over the maximum to the default one
+        blob_ttl = min(ttl + int(ttl * BLOB_TTL_MARGIN), Config.CACHE_TTL_MAX)
+
+        with self.lock:
+            self.stats["image_writes"] += 1
+            self.stats["image_bytes"] += len(image_data)
+
+            # Skip the write if the blob we wrote earlier outlives this pointer
+            if self.written.get(image_hash, 0) >= time.time() + ttl:
+                self.written.move_to_end(image_hash)
+                return pointer, None
+
+        return pointer, (image_hash, bytes(image_data), blob_ttl)
+
+    def _written(self, image_hash: str, image_data: bytes, blob_ttl: int, written_at: float) -> None:
+        """
+        Remember a blob stored by this worker and until when it lives.
+
+        Args:
+            image_hash: The image hash
+            image_data: The image bytes
+            blob_ttl: Time to live the blob was stored with
+            written_at: Unix timestamp taken before the write
+        """
+        with self.lock:
+            self.written[image_hash] = written_at + blob_ttl
+            self.written.move_to_end(image_hash)
+            while len(self.written) > MAX_TRACKED_BLOBS:
+                self.written.popitem(last=False)
+
+            self.stats["blob_writes"] += 1
+            self.stats["blob_bytes"] += len(image_data)
+
+    def _write_blob(self, blob: Tuple[str, bytes, int]) -> bool:
+        """Store a blob returned by ``_split``, returning True if the backend kept it."""
+        image_hash, image_data, blob_ttl = blob
+        written_at = time.time()
+        if not self.backend.set(f"{BLOB_PREFIX}{image_hash}", {"image_data": image_data, "image_url": None}, blob_ttl):
+            return False
+
+        self._written(image_hash, image_data, blob_ttl, written_at)
+        return True
+
+    async def _awrite_blob(self, blob: Tuple[str, bytes, int]) -> bool:
+        """Async variant of _write_blob."""
+        image_hash, image_data, blob_ttl = blob
+        written_at = time.time()
+        blob_value = {"image_data": image_data, "image_url": None}
+        if not await self.backend.aset(f"{BLOB_PREFIX}{image_hash}", blob_value, blob_ttl):
+            return False
+
+        self._written(image_hash, image_data, blob_ttl, written_at)
+        return True
+
+    def _join(self, value: Optional[Dict[str, Any]], blob: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Put the image bytes of a blob back into a pointer record.
+
+        Args:
+            value: The pointer record or None
+            blob: The blob entry or None if it is missing
+
+        Returns:
+            Optional[Dict]: The value with its image bytes, or without them if the blob is missing
+        """
+        if get_blob_key(value) is None:
+            return value
+
+        image_data = blob.get("image_data") if blob else None
+        if image_data is None:
+            with self.lock:
+                self.stats["missing_blobs"] += 1
+                # Write the blob again the next time this image is stored
+                self.written.pop(value["image_hash"], None)
+
+        return {**value, "image_data": image_data}
+
+    def _blob_keys(self, values: Iterable[Optional[Dict[str, Any]]]) -> list:
+        """Get the blob keys referenced by pointer records."""
+        return list({get_blob_key(value) for value in values} - {None})
+
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata, loading its image from the blob store.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        value, metadata, blob = self.backend.get_with_blob(key)
+        return self._join(value, blob), metadata
+
+    async def aget_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Async variant of get_with_metadata.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        value, metadata, blob = await self.backend.aget_with_blob(key)
+        return self._join(value, blob), metadata
+
+    def get_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys, loading all their images in one more lookup.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        results = self.backend.get_many_with_metadata(keys)
+
+        blob_keys = self._blob_keys(value for value, _ in results.values())
+        if not blob_keys:
+            return results
+
+        blobs = self.backend.peek_many_with_metadata(blob_keys)
+        return {
+            key: (self._join(value, blobs.get(get_blob_key(value), (None, None))[0]), metadata)
+            for key, (value, metadata) in results.items()
+        }
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Store the image in the blob store if needed, then the pointer record.
+
+        If the blob is refused, the value is stored whole instead.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        pointer, blob = self._split(value, ttl)
+        if blob is not None and not self._write_blob(blob):
+            return self.backend.set(key, value, ttl)
+
+        return self.backend.set(key, pointer, ttl)
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Async variant of set.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        pointer, blob = self._split(value, ttl)
+        if blob is not None and not await self._awrite_blob(blob):
+            return await self.backend.aset(key, value, ttl)
+
+        return await self.backend.aset(key, pointer, ttl)
+
+    def set_many(self, values: Dict[str, Dict[str, Any]], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set several values with the same TTL, writing their new blobs in one batch first.
+
+        If the blob batch is not stored in full, the values that needed a blob
+        are stored whole instead.
+
+        Args:
+            values: Maps cache keys to the values to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if every value was stored
+        """
+        pointers = {}
+        blobs = {}
+        needs_blob = []
+        for key, value in values.items():
+            pointer, blob = self._split(value, ttl)
+            if blob is not None:
+                blobs[blob[0]] = blob
+                needs_blob.append(key)
+            pointers[key] = pointer
+
+        if blobs:
+            # Every blob of the batch gets the same TTL, derived from the shared entry TTL
+            blob_ttl = next(iter(blobs.values()))[2]
+            written_at = time.time()
+            entries = {
+                f"{BLOB_PREFIX}{image_hash}": {"image_data": image_data, "image_url": None}
+                for image_hash, image_data, _ in blobs.values()
+            }
+            if self.backend.set_many(entries, blob_ttl):
+                for image_hash, image_data, _ in blobs.values():
+                    self._written(image_hash, image_data, blob_ttl, written_at)
+            else:
+                pointers.update({key: values[key] for key in needs_blob})
+
+        return self.backend.set_many(pointers, ttl)
+
+    async def aclose(self) -> None:
+        """Close the backend's async connections."""
+        await self.backend.aclose()
+
+    def delete(self, key: str) -> bool:
+        """
+        Delete a pointer record, its blob expires on its own.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            bool: True if deleted, False if not found
+        """
+        return self.backend.delete(key)
+
+    def delete_pattern(self, pattern: str) -> int:
+        """
+        Delete all keys matching a pattern.
+
+        Args:
+            pattern: The pattern to match
+
+        Returns:
+            int: Number of keys deleted
+        """
+        return self.backend.delete_pattern(pattern)
+
+    def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get metadata for a cached item.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: Metadata or None if not found
+        """
+        return self.backend.get_metadata(key)
+
+    def get_metadata_many(self, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get metadata for several keys.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to its metadata or None if not found
+        """
+        return self.backend.get_metadata_many(keys)
+
+    def clear(self) -> bool:
+        """
+        Clear all cache data.
+
+        Returns:
+            bool: True if successful
+        """
+        with self.lock:
+            self.written.clear()
+        return self.backend.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dict[str, Any]: Backend statistics plus this worker's dedup counters, where
+                ``ratio`` is image bytes stored by entries over blob bytes actually written
+        """
+        with self.lock:
+            dedup = dict(self.stats)
+
+        dedup["ratio"] = round(dedup["image_bytes"] / dedup["blob_bytes"], 2) if dedup["blob_bytes"] else None
+        return {**self.backend.get_stats(), "dedup": dedup}
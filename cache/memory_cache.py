@@ -1,58 +1,307 @@
+import heapq
+import os
 import re
+import threading
 import time
-from datetime import datetime
-from typing import Any, Dict, Optional, Union
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from cache.base import BaseCache
+from cache.sketch import FrequencySketch
+from cache.utils import (
+    PeriodicTask,
+    decode_binary_data,
+    encode_binary_data,
+    estimate_size,
+    format_metadata,
+    freeze_binary_data,
+    get_ttl,
+)
+from config import Config
+
+
+class MemoryCache(BaseCache):
+    """
+    In-memory cache implementation with binary data support.
+
+    The cache is bounded by an entry count and a byte budget. Entries are kept
+    in LRU order and new entries are only admitted over the LRU victims when
+    the TinyLFU frequency sketch considers them at least as popular, so
+    one-off scans cannot push hot avatars out.
+
+    Expired entries are kept for ``stale_grace`` more seconds so they can be
+    served stale, then removed proactively by a background sweeper that pops
+    a removal-ordered heap in bounded batches.
+
+    In raw mode (the default) image data is stored as immutable ``bytes`` and
+    a hit hands out the same buffer, skipping the base64 round-trip.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        store_raw: Optional[bool] = None,
+        max_ttl: Optional[int] = None,
+        stale_grace: Optional[int] = None,
+    ):
+        """
+        Initialize the memory cache.
 
-from cache.utils import decode_binary_data, encode_binary_data, get_ttl
+        Args:
+            max_entries: Maximum number of entries, 0 for unbounded
+            max_bytes: Maximum resident bytes, 0 for unbounded
+            store_raw: Keep image bytes as-is instead of base64 encoding them
+            max_ttl: Upper bound for entry lifetimes in seconds, None for no cap
+            stale_grace: Seconds an expired entry is still served as stale
+        """
+        self.max_entries = Config.CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_bytes = Config.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.store_raw = Config.CACHE_MEMORY_RAW if store_raw is None else store_raw
+        self.max_ttl = max_ttl
+        self.stale_grace = Config.CACHE_STALE_GRACE if stale_grace is None else stale_grace
+        self.cache = OrderedDict()
+        self.sketch = FrequencySketch(self.max_entries or 10000)
+        self.expiry_heap = []
+        # Heap set aside while the sweeper drops its stale records, None otherwise
+        self.compacting = None
+        self.lock = threading.RLock()
+        self.stats = {"hits": 0, "misses": 0, "size": 0, "bytes": 0, "evictions": 0, "rejections": 0, "expired": 0}
+        self.prefix = "wisp:cache:"
+        self.sweeper = PeriodicTask(self.sweep, Config.CACHE_SWEEP_INTERVAL, "wisp-cache-sweeper")
 
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
 
-class MemoryCache:
-    """In-memory cache implementation with binary data support."""
+    def _reset_lock(self) -> None:
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.RLock()
 
-    def __init__(self):
-        """Initialize the memory cache."""
-        self.cache = {}
-        self.stats = {"hits": 0, "misses": 0, "size": 0}
-        self.prefix = "wisp:cache:"
-        self.metadata_prefix = "wisp:metadata:"
+        # The compaction does not survive the fork, put the records it had not checked back
+        if self.compacting is not None:
+            self.expiry_heap = self.compacting + self.expiry_heap
+            heapq.heapify(self.expiry_heap)
+            self.compacting = None
 
     def _get_cache_key(self, key: str) -> str:
         """Get the full cache key with prefix."""
         return f"{self.prefix}{key}"
 
-    def _get_metadata_key(self, key: str) -> str:
-        """Get the full metadata key with prefix."""
-        return f"{self.metadata_prefix}{key}"
+    def _get_item(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Get a live or stale cache item, dropping it once the grace window has passed."""
+        cache_item = self.cache.get(cache_key)
+        if cache_item is None:
+            return None
+
+        if cache_item["removes_at"] < time.time():
+            self._remove(cache_key)
+            return None
+
+        return cache_item
+
+    def _remove(self, cache_key: str) -> bool:
+        """Remove an item and update the size counters."""
+        cache_item = self.cache.pop(cache_key, None)
+        if cache_item is None:
+            return False
+
+        self.stats["size"] -= 1
+        self.stats["bytes"] -= cache_item["size"]
+        return True
+
+    def _over_budget(self, entries: int, resident: int) -> bool:
+        """Check whether the given totals exceed the configured limits."""
+        return bool((self.max_entries and entries > self.max_entries) or (self.max_bytes and resident > self.max_bytes))
+
+    def _admit(self, cache_key: str, size: int) -> bool:
+        """
+        Make room for a new entry, evicting LRU victims it beats on frequency.
+
+        Args:
+            cache_key: The full key of the candidate entry
+            size: The estimated size of the candidate entry
+
+        Returns:
+            bool: True if the candidate was admitted
+        """
+        if self.max_bytes and size > self.max_bytes:
+            return False
+
+        entries = len(self.cache)
+        resident = self.stats["bytes"]
+        existing = self.cache.get(cache_key)
+        if existing is not None:
+            entries -= 1
+            resident -= existing["size"]
+
+        victims = []
+        candidate_frequency = self.sketch.frequency(cache_key)
+        for victim_key, victim in self.cache.items():
+            if not self._over_budget(entries + 1, resident + size):
+                break
+
+            if victim_key == cache_key:
+                continue
+
+            # Ties are admitted, otherwise equally cold entries could never replace each other
+            if victim["expires_at"] >= time.time() and self.sketch.frequency(victim_key) > candidate_frequency:
+                return False
+
+            victims.append(victim_key)
+            entries -= 1
+            resident -= victim["size"]
+
+        if self._over_budget(entries + 1, resident + size):
+            return False
+
+        for victim_key in victims:
+            self._remove(victim_key)
+            self.stats["evictions"] += 1
+
+        return True
+
+    def sweep(self, limit: Optional[int] = None) -> int:
+        """
+        Remove entries past their grace window in removal order, doing at most ``limit`` heap pops.
+
+        Args:
+            limit: Maximum number of heap records to process
+
+        Returns:
+            int: Number of entries removed
+        """
+        limit = Config.CACHE_SWEEP_BATCH if limit is None else limit
+        removed = 0
+        compact = False
+
+        with self.lock:
+            current_time = time.time()
+
+            for _ in range(limit):
+                if not self.expiry_heap or self.expiry_heap[0][0] >= current_time:
+                    break
+
+                removes_at, cache_key = heapq.heappop(self.expiry_heap)
+                cache_item = self.cache.get(cache_key)
+
+                # Skip records left behind by overwritten or deleted entries
+                if cache_item is not None and cache_item["removes_at"] == removes_at:
+                    self._remove(cache_key)
+                    self.stats["expired"] += 1
+                    removed += 1
+
+            # Drop stale heap records once they outnumber the live entries
+            if len(self.expiry_heap) > 2 * len(self.cache) + 1024 and self.compacting is None:
+                self.compacting = self.expiry_heap
+                self.expiry_heap = []
+                compact = True
+
+        if compact:
+            self._compact_heap(max(limit, 1))
+
+        return removed
+
+    def _compact_heap(self, batch: int) -> None:
+        """
+        Drop the stale records of the heap set aside in ``compacting``, holding the lock for one batch at a time.
+
+        New records go to a fresh heap meanwhile, which is merged into the
+        records kept when they are swapped in. Entries overwritten or removed
+        after their record was checked leave a stale record, skipped by the
+        sweep like any other.
+
+        Args:
+            batch: Number of records checked per lock hold
+        """
+        records = self.compacting
+        kept = []
+
+        for start in range(0, len(records), batch):
+            with self.lock:
+                # Dropped by clear()
+                if self.compacting is not records:
+                    return
+
+                for removes_at, cache_key in records[start : start + batch]:
+                    cache_item = self.cache.get(cache_key)
+                    if cache_item is not None and cache_item["removes_at"] == removes_at:
+                        kept.append((removes_at, cache_key))
 
-    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        heapq.heapify(kept)
+
+        with self.lock:
+            if self.compacting is not records:
+                return
+
+            for record in self.expiry_heap:
+                heapq.heappush(kept, record)
+            self.expiry_heap = kept
+            self.compacting = None
+
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
         """
-        Get a value from the cache.
+        Get a value and its metadata in a single lookup.
 
         Args:
             key: The cache key
 
         Returns:
-            Optional[Dict]: The cached value or None if not found
+            Tuple: (value, metadata), both None if not found
         """
+        return self._read(key, count=True)
+
+    def peek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys without counting them in the hit and miss statistics.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        return {key: self._read(key, count=False) for key in keys}
+
+    def _read(self, key: str, count: bool) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Look up an entry, refreshing its recency and frequency.
+
+        Args:
+            key: The cache key
+            count: Count the lookup in the hit and miss statistics
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        self.sweeper.ensure_started()
         cache_key = self._get_cache_key(key)
 
-        if cache_key not in self.cache:
-            self.stats["misses"] += 1
-            return None
+        with self.lock:
+            self.sketch.increment(cache_key)
+            cache_item = self._get_item(cache_key)
 
-        cache_item = self.cache[cache_key]
-        current_time = time.time()
+            if cache_item is None:
+                if count:
+                    self.stats["misses"] += 1
+                return None, None
 
-        if cache_item["expires_at"] < current_time:
-            self.delete(key)
-            self.stats["misses"] += 1
-            return None
+            self.cache.move_to_end(cache_key)
+            if count:
+                self.stats["hits"] += 1
+
+        metadata = format_metadata(cache_item["stored_at"], cache_item["expires_at"])
+
+        if not cache_item["data"]:
+            return None, metadata
+
+        # Raw entries share their immutable buffers, only the dict is copied
+        if self.store_raw:
+            return dict(cache_item["data"]), metadata
 
-        self.stats["hits"] += 1
         # Handle binary data decoding
-        if cache_item["data"]:
-            return decode_binary_data(cache_item["data"])
-        return None
+        return decode_binary_data(cache_item["data"]), metadata
 
     def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
         """
@@ -64,35 +313,41 @@ class MemoryCache:
             ttl: Time to live in seconds
 
         Returns:
-            bool: True if successful
+            bool: True if stored, False if rejected by the admission policy
         """
         # Validate and normalize TTL
         ttl = get_ttl(ttl)
+        if self.max_ttl:
+            ttl = min(ttl, self.max_ttl)
 
         cache_key = self._get_cache_key(key)
-        metadata_key = self._get_metadata_key(key)
 
         current_time = time.time()
         expires_at = current_time + ttl
-
-        # Encode binary data
-        serializable_value = encode_binary_data(value)
-
-        if cache_key not in self.cache:
+        removes_at = expires_at + self.stale_grace
+
+        self.sweeper.ensure_started()
+
+        # Encode binary data unless it can be kept as-is
+        serializable_value = freeze_binary_data(value) if self.store_raw else encode_binary_data(value)
+        size = estimate_size(cache_key, serializable_value)
+
+        with self.lock:
+            if not self._admit(cache_key, size):
+                self.stats["rejections"] += 1
+                return False
+
+            self._remove(cache_key)
+            self.cache[cache_key] = {
+                "data": serializable_value,
+                "stored_at": current_time,
+                "expires_at": expires_at,
+                "removes_at": removes_at,
+                "size": size,
+            }
+            heapq.heappush(self.expiry_heap, (removes_at, cache_key))
             self.stats["size"] += 1
-
-        self.cache[cache_key] = {
-            "data": serializable_value,
-            "stored_at": current_time,
-            "expires_at": expires_at,
-        }
-
-        # Store metadata separately
-        self.cache[metadata_key] = {
-            "data": {"stored_at": current_time, "expires_at": expires_at},
-            "stored_at": current_time,
-            "expires_at": expires_at,
-        }
+            self.stats["bytes"] += size
 
         return True
 
@@ -106,23 +361,8 @@ class MemoryCache:
         Returns:
             bool: True if deleted, False if not found
         """
-        cache_key = self._get_cache_key(key)
-        metadata_key = self._get_metadata_key(key)
-
-        deleted = False
-
-        if cache_key in self.cache:
-            del self.cache[cache_key]
-            deleted = True
-
-        if metadata_key in self.cache:
-            del self.cache[metadata_key]
-
-        if deleted:
-            self.stats["size"] -= 1
-            return True
-
-        return False
+        with self.lock:
+            return self._remove(self._get_cache_key(key))
 
     def delete_pattern(self, pattern: str) -> int:
         """
@@ -137,14 +377,13 @@ class MemoryCache:
         pattern = pattern.replace("*", ".*")
         regex = re.compile(f"{self.prefix}{pattern}")
 
-        keys_to_delete = [key for key in self.cache.keys() if regex.match(key)]
-        count = 0
+        with self.lock:
+            keys_to_delete = [key for key in self.cache.keys() if regex.match(key)]
+            count = 0
 
-        for key in keys_to_delete:
-            # Extract the original key without prefix
-            original_key = key[len(self.prefix) :]
-            if self.delete(original_key):
-                count += 1
+            for key in keys_to_delete:
+                if self._remove(key):
+                    count += 1
 
         return count
 
@@ -158,24 +397,13 @@ class MemoryCache:
         Returns:
             Optional[Dict]: Metadata or None if not found
         """
-        metadata_key = self._get_metadata_key(key)
-
-        if metadata_key not in self.cache:
-            return None
-
-        cache_item = self.cache[metadata_key]
-        current_time = time.time()
+        with self.lock:
+            cache_item = self._get_item(self._get_cache_key(key))
 
-        if cache_item["expires_at"] < current_time:
-            self.delete(key)
+        if cache_item is None:
             return None
 
-        metadata = cache_item["data"]
-        return {
-            "status": "hit",
-            "stored_at": datetime.fromtimestamp(metadata["stored_at"]).isoformat(),
-            "expires_at": datetime.fromtimestamp(metadata["expires_at"]).isoformat(),
-        }
+        return format_metadata(cache_item["stored_at"], cache_item["expires_at"])
 
     def clear(self) -> bool:
         """
@@ -184,8 +412,12 @@ class MemoryCache:
         Returns:
             bool: True if successful
         """
-        self.cache = {}
-        self.stats["size"] = 0
+        with self.lock:
+            self.cache = OrderedDict()
+            self.expiry_heap = []
+            self.compacting = None
+            self.stats["size"] = 0
+            self.stats["bytes"] = 0
         return True
 
     def get_stats(self) -> Dict[str, int]:
@@ -195,4 +427,5 @@ class MemoryCache:
         Returns:
             Dict[str, int]: Cache statistics
         """
-        return self.stats
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import redis
+
+from config import Config
+
+# Failure class of each provider error status, other statuses are not cached
+ERROR_CLASSES = {404: "not_found", 429: "rate_limited", 503: "timeout", 504: "timeout"}
+
+
+class NegativeCache:
+    """
+    Short-lived cache of upstream failures, so repeated requests for a missing
+    user or a service that blocks us are answered without upstream traffic.
+
+    Entries are kept apart from the avatar cache, so they expire after the TTL
+    of their failure class with no stale grace and do not count as cache hits
+    or misses. With a Redis client they are plain Redis keys shared by every
+    worker, otherwise they are kept in a bounded dict in this worker.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None, get_async_redis: Optional[Callable] = None):
+        """
+        Initialize the negative cache.
+
+        Args:
+            redis_client: Client to share entries across workers, None to keep them in this worker
+            get_async_redis: Returns the asyncio Redis client of the running loop
+        """
+        self.redis = redis_client
+        self.get_async_redis = get_async_redis
+        self.prefix = "wisp:negative:"
+        self.ttls = {
+            "not_found": Config.CACHE_NEGATIVE_TTL_NOT_FOUND,
+            "rate_limited": Config.CACHE_NEGATIVE_TTL_RATE_LIMITED,
+            "timeout": Config.CACHE_NEGATIVE_TTL_TIMEOUT,
+        }
+        self.max_entries = Config.CACHE_MAX_ENTRIES or 10000
+        self.entries = OrderedDict()
+        self.stats = {"hits": dict.fromkeys(self.ttls, 0), "stores": dict.fromkeys(self.ttls, 0), "misses": 0}
+        self.lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.Lock()
+
+    def _get_key(self, key: str) -> str:
+        """Get the storage key of a negative entry."""
+        return f"{self.prefix}{key}"
+
+    def _entry(self, status_code: Optional[int], message: str) -> Optional[Dict[str, Any]]:
+        """Build the stored entry for an error, or None if its class is not cached."""
+        error_class = ERROR_CLASSES.get(status_code)
+        if error_class is None or not self.ttls[error_class]:
+            return None
+
+        return {
+            "error": str(message),
+            "status_code": status_code,
+            "error_class": error_class,
+            "negative_expires_at": time.time() + self.ttls[error_class],
+        }
+
+    def _read(self, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Check a stored entry and count the lookup."""
+        live = value is not None and value.get("negative_expires_at", 0) >= time.time()
+
+        with self.lock:
+            if live:
+                self.stats["hits"][value["error_class"]] += 1
+            else:
+                self.stats["misses"] += 1
+
+        return value if live else None
+
+    def _decode(self, data: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """Decode an entry read from Redis."""
+        if data is None:
+            return None
+
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get an entry kept in this worker."""
+        with self.lock:
+            return self.entries.get(self._get_key(key))
+
+    def _set_local(self, key: str, entry: Dict[str, Any]) -> bool:
+        """Keep an entry in this worker, dropping expired and then the oldest entries past the bound."""
+        now = time.time()
+
+        with self.lock:
+            self.entries[self._get_key(key)] = entry
+            self.entries.move_to_end(self._get_key(key))
+
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if len(self.entries) <= self.max_entries and oldest["negative_expires_at"] >= now:
+                    break
+                self.entries.popitem(last=False)
+
+        return True
+
+    def _count_store(self, entry: Dict[str, Any]) -> None:
+        """Count a stored entry."""
+        with self.lock:
+            self.stats["stores"][entry["error_class"]] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the remembered failure for a key.
+
+        Args:
+            key: The cache key of the avatar
+
+        Returns:
+            Optional[Dict]: The entry with "error" and "status_code", or None
+        """
+        if self.redis is None:
+            return self._read(self._get_local(key))
+
+        try:
+            return self._read(self._decode(self.redis.get(self._get_key(key))))
+        except redis.RedisError:
+            return self._read(None)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get the remembered failures for several keys in one lookup.
+
+        Args:
+            keys: The cache keys of the avatars
+
+        Returns:
+            Dict: Maps every key to its entry or None
+        """
+        keys = list(keys)
+        if self.redis is None:
+            return {key: self._read(self._get_local(key)) for key in keys}
+
+        try:
+            values = self.redis.mget([self._get_key(key) for key in keys]) if keys else []
+        except redis.RedisError:
+            values = [None] * len(keys)
+        return {key: self._read(self._decode(data)) for key, data in zip(keys, values)}
+
+    def set(self, key: str, status_code: Optional[int], message: str) -> bool:
+        """
+        Remember a failure if its class is cached.
+
+        Args:
+            key: The cache key of the avatar
+            status_code: The status class of the failure
+            message: The error message to serve
+
+        Returns:
+            bool: True if the failure was stored
+        """
+        entry = self._entry(status_code, message)
+        if entry is None:
+            return False
+
+        self._count_store(entry)
+        if self.redis is None:
+            return self._set_local(key, entry)
+
+        try:
+            return bool(self.redis.set(self._get_key(key), json.dumps(entry), ex=self.ttls[entry["error_class"]]))
+        except redis.RedisError:
+            return False
+
+    def delete(self, key: str) -> bool:
+        """
+        Forget the failure for a key.
+
+        Args:
+            key: The cache key of the avatar
+
+        Returns:
+            bool: True if an entry was deleted
+        """
+        if self.redis is None:
+            with self.lock:
+                return self.entries.pop(self._get_key(key), None) is not None
+
+        try:
+            return bool(self.redis.delete(self._get_key(key)))
+        except redis.RedisError:
+            return False
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Async variant of get.
+
+        Args:
+            key: The cache key of the avatar
+
+        Returns:
+            Optional[Dict]: The entry with "error" and "status_code", or None
+        """
+        if self.get_async_redis is None:
+            return self._read(self._get_local(key))
+
+        try:
+            return self._read(self._decode(await self.get_async_redis().get(self._get_key(key))))
+        except redis.RedisError:
+            return self._read(None)
+
+    async def aset(self, key: str, status_code: Optional[int], message: str) -> bool:
+        """
+        Async variant of set.
+
+        Args:
+            key: The cache key of the avatar
+            status_code: The status class of the failure
+            message: The error message to serve
+
+        Returns:
+            bool: True if the failure was stored
+        """
+        entry = self._entry(status_code, message)
+        if entry is None:
+            return False
+
+        self._count_store(entry)
+        if self.get_async_redis is None:
+            return self._set_local(key, entry)
+
+        try:
+            ttl = self.ttls[entry["error_class"]]
+            return bool(await self.get_async_redis().set(self._get_key(key), json.dumps(entry), ex=ttl))
+        except redis.RedisError:
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get negative cache statistics for this worker.
+
+        Returns:
+            Dict[str, Any]: Hits and stores per failure class, misses and the configured TTLs
+        """
+        with self.lock:
+            return {
+                "hits": dict(self.stats["hits"]),
+                "stores": dict(self.stats["stores"]),
+                "misses": self.stats["misses"],
+                "ttls": dict(self.ttls),
+            }
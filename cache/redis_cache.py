@@ -1,30 +1,93 @@
+import asyncio
 import json
+import threading
 import time
-from datetime import datetime
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
 
 import redis
-
-from cache.utils import compress_data, decode_binary_data, decompress_data, encode_binary_data, get_ttl
+import redis.asyncio
+
+from cache.base import BaseCache
+from cache.utils import (
+    CounterBuffer,
+    PeriodicTask,
+    decode_binary_data,
+    decompress_data,
+    format_metadata,
+    get_ttl,
+    is_envelope,
+    pack_entry,
+    unpack_entry,
+    unpack_entry_header,
+)
 from config import Config
 
-
-class RedisCache:
-    """Redis cache implementation with compression and binary data support."""
+# Store the entry, drop any legacy metadata key and record the expiry in the size index in a
+# single round-trip. Each call also prunes a bounded number of expired index members.
+SET_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('UNLINK', KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[3], KEYS[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[4], 'LIMIT', 0, 100)
+if #expired > 0 then
+    redis.call('ZREM', KEYS[3], unpack(expired))
+end
+return 1
+"""
+
+# Remove value, metadata and index member atomically
+DELETE_SCRIPT = """
+local deleted = redis.call('UNLINK', KEYS[1])
+redis.call('UNLINK', KEYS[2])
+redis.call('ZREM', KEYS[3], KEYS[1])
+return deleted
+"""
+
+SCAN_BATCH = 1000
+
+# Seconds between checks that the size index has been built
+INDEX_CHECK_INTERVAL = 60
+
+
+class RedisCache(BaseCache):
+    """
+    Redis cache implementation with compression and binary data support.
+
+    Entries are stored in the binary envelope from ``cache.utils`` (header
+    plus raw image bytes) under a single key. Legacy JSON entries with a
+    separate metadata key are still read and rewritten as envelopes on hit.
+    Keys outlive the entry's expiry by ``CACHE_STALE_GRACE`` seconds so it can
+    still be served as stale.
+    """
 
     def __init__(self):
         """Initialize the Redis cache."""
         self.redis = redis.from_url(Config.REDIS_URL)
         self.stats_key = "wisp:cache:stats"
+        self.index_key = "wisp:index"
+        # Set once the index covers the keyspace, it outlives the index itself emptying out
+        self.index_ready_key = "wisp:index:ready"
         self.prefix = "wisp:cache:"
         self.metadata_prefix = "wisp:metadata:"
+        self.stale_grace = Config.CACHE_STALE_GRACE
 
         # Initialize stats if they don't exist
         if not self.redis.exists(self.stats_key):
-            self.redis.hmset(self.stats_key, {"hits": 0, "misses": 0, "size": 0})
-
-        # Recalculate size on initialization to ensure accuracy
-        self._recalculate_size()
+            self.redis.hset(self.stats_key, mapping={"hits": 0, "misses": 0})
+
+        self.set_script = self.redis.register_script(SET_SCRIPT)
+        self.counters = CounterBuffer(
+            self._flush_counters, Config.CACHE_STATS_FLUSH_INTERVAL, Config.CACHE_STATS_FLUSH_EVENTS
+        )
+        self.delete_script = self.redis.register_script(DELETE_SCRIPT)
+        self.async_redis = None
+        self.async_set_script = None
+        self.async_loop = None
+
+        # Entries written before the size index existed are indexed in the background, so start-up never waits
+        self.indexer = PeriodicTask(self._ensure_index, INDEX_CHECK_INTERVAL, "wisp-cache-indexer")
+        self.indexer.ensure_started()
+        self.indexer.wake()
 
     def _get_cache_key(self, key: str) -> str:
         """Get the full cache key with prefix."""
@@ -34,37 +97,290 @@ class RedisCache:
         """Get the full metadata key with prefix."""
         return f"{self.metadata_prefix}{key}"
 
-    def _recalculate_size(self) -> None:
-        """Recalculate the size based on actual keys in the cache."""
-        cache_keys = self.redis.keys(f"{self.prefix}*")
-        size = len(cache_keys)
-        self.redis.hset(self.stats_key, "size", size)
+    def _scan(self, match: str):
+        """
+        Iterate over keys matching a pattern in batches, without blocking Redis.
+
+        Args:
+            match: Full key pattern, including the prefix
+
+        Yields:
+            list: A batch of keys
+        """
+        batch = []
+        for key in self.redis.scan_iter(match=match, count=SCAN_BATCH):
+            if key.decode("utf-8") == self.stats_key:
+                continue
+
+            batch.append(key)
+            if len(batch) >= SCAN_BATCH:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def _ensure_index(self) -> None:
+        """Rebuild the size index if it was never built, in one worker at a time."""
+        if self.redis.exists(self.index_key, self.index_ready_key):
+            return
+
+        if self.redis.set(f"{self.index_key}:rebuild", 1, nx=True, ex=300):
+            self.rebuild_index()
+
+    def rebuild_index(self) -> int:
+        """
+        Rebuild the size index from the keyspace with incremental SCAN.
+
+        Returns:
+            int: Number of indexed keys
+        """
+        count = 0
+        current_time = time.time()
+
+        for batch in self._scan(f"{self.prefix}*"):
+            pipe = self.redis.pipeline(transaction=False)
+            for cache_key in batch:
+                pipe.ttl(cache_key)
+            ttls = pipe.execute()
+
+            members = {key: current_time + ttl for key, ttl in zip(batch, ttls) if ttl > 0}
+            if members:
+                self.redis.zadd(self.index_key, members)
+                count += len(members)
+
+        self.redis.set(self.index_ready_key, 1)
+        return count
+
+    def get_async_redis(self) -> "redis.asyncio.Redis":
+        """
+        Get the asyncio Redis client of the running event loop.
+
+        Returns:
+            redis.asyncio.Redis: The client, created on first use in each loop
+        """
+        loop = asyncio.get_running_loop()
+        if self.async_redis is None or self.async_loop is not loop:
+            self._close_async_redis()
+            self.async_redis = redis.asyncio.from_url(Config.REDIS_URL)
+            self.async_set_script = self.async_redis.register_script(SET_SCRIPT)
+            self.async_loop = loop
+        return self.async_redis
+
+    def _close_async_redis(self) -> None:
+        """
+        Close the asyncio client of a previous event loop before it is replaced.
+
+        Its connections belong to that loop, so ``aclose`` runs there: scheduled
+        on it if it still runs in another thread, or on a helper thread if it is
+        stopped. Nothing can run on a closed loop any more, its connections are
+        closed when the client is garbage collected.
+        """
+        client, loop = self.async_redis, self.async_loop
+        if client is None or loop is None or loop.is_closed():
+            return
+
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            threading.Thread(target=loop.run_until_complete, args=(client.aclose(),), daemon=True).start()
+
+    def _flush_counters(self, counts: Dict[str, int]) -> None:
+        """Add this worker's buffered hit/miss counts to the shared stats hash."""
+        pipe = self.redis.pipeline(transaction=False)
+        for field, amount in counts.items():
+            pipe.hincrby(self.stats_key, field, amount)
+        pipe.execute()
+
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata in one round-trip.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        data, metadata = self.redis.mget(self._get_cache_key(key), self._get_metadata_key(key))
+        self.counters.incr("hits" if data is not None else "misses")
+        return self._decode(key, data, metadata)
 
-    def get(self, key: str) -> Optional[Dict[str, Any]]:
+    async def aget_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
         """
-        Get a value from the cache.
+        Async variant of get_with_metadata.
 
         Args:
             key: The cache key
 
         Returns:
-            Optional[Dict]: The cached value or None if not found
+            Tuple: (value, metadata), both None if not found
+        """
+        client = self.get_async_redis()
+        data, metadata = await client.mget(self._get_cache_key(key), self._get_metadata_key(key))
+        self.counters.incr("hits" if data is not None else "misses")
+        return self._decode(key, data, metadata)
+
+    def get_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys with a single MGET round-trip.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        cache_keys = [self._get_cache_key(key) for key in keys]
+        metadata_keys = [self._get_metadata_key(key) for key in keys]
+        values = self.redis.mget(cache_keys + metadata_keys)
+
+        hits = sum(1 for data in values[: len(keys)] if data is not None)
+        if hits:
+            self.counters.incr("hits", hits)
+        if hits < len(keys):
+            self.counters.incr("misses", len(keys) - hits)
+
+        return {
+            key: self._decode(key, data, metadata)
+            for key, data, metadata in zip(keys, values[: len(keys)], values[len(keys) :])
+        }
+
+    def peek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys with a single MGET round-trip, without counting them.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        values = self.redis.mget(
+            [self._get_cache_key(key) for key in keys] + [self._get_metadata_key(key) for key in keys]
+        )
+        return {
+            key: self._decode(key, data, metadata)
+            for key, data, metadata in zip(keys, values[: len(keys)], values[len(keys) :])
+        }
+
+    async def apeek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Async variant of peek_many_with_metadata.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
         """
-        cache_key = self._get_cache_key(key)
-        data = self.redis.get(cache_key)
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        values = await self.get_async_redis().mget(
+            [self._get_cache_key(key) for key in keys] + [self._get_metadata_key(key) for key in keys]
+        )
+        return {
+            key: self._decode(key, data, metadata)
+            for key, data, metadata in zip(keys, values[: len(keys)], values[len(keys) :])
+        }
+
+    def _decode(
+        self, key: str, data: Optional[bytes], metadata: Optional[bytes]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Decode a stored entry into (value, metadata).
+
+        Args:
+            key: The cache key
+            data: The stored entry or None if not found
+            metadata: The legacy metadata key, only used for legacy entries
 
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
         if data is None:
-            self.redis.hincrby(self.stats_key, "misses", 1)
-            return None
+            return None, None
+
+        if is_envelope(data):
+            entry = unpack_entry(data)
+            if entry is None:
+                return None, None
+
+            value, stored_at, expires_at = entry
+            return value, format_metadata(stored_at, expires_at)
+
+        return self._read_legacy(key, data, metadata)
+
+    def _read_legacy(
+        self, key: str, data: bytes, metadata: Optional[bytes]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Decode a legacy JSON+base64+zlib entry and rewrite it as an envelope.
 
-        self.redis.hincrby(self.stats_key, "hits", 1)
+        Args:
+            key: The cache key
+            data: The stored entry
+            metadata: The stored legacy metadata
 
+        Returns:
+            Tuple: (value, metadata)
+        """
         # Decompress and decode the data
         decompressed_data = decompress_data(data)
-        if decompressed_data:
-            return decode_binary_data(decompressed_data)
+        value = decode_binary_data(decompressed_data) if decompressed_data else None
+
+        timestamps = self._parse_legacy_metadata(metadata)
+        if timestamps is None:
+            return value, None
+
+        stored_at, expires_at = timestamps
+        if isinstance(value, dict):
+            # Keep the remaining TTL, and only overwrite the key if it still exists
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self._get_cache_key(key), pack_entry(value, stored_at, expires_at), keepttl=True, xx=True)
+            pipe.unlink(self._get_metadata_key(key))
+            pipe.execute()
+
+        return value, format_metadata(stored_at, expires_at)
+
+    def _set_args(self, value: Dict[str, Any], ttl: int, current_time: float) -> list:
+        """
+        Build the SET_SCRIPT arguments for an entry.
 
-        return None
+        The key lives for the grace window past the entry's expiry, and the
+        size index scores it by when the key itself expires.
+
+        Args:
+            value: The value to cache
+            ttl: Validated time to live in seconds
+            current_time: Unix timestamp the entry is stored at
+
+        Returns:
+            list: envelope, key TTL, index score and current time
+        """
+        expires_at = current_time + ttl
+        return [
+            pack_entry(value, current_time, expires_at),
+            ttl + self.stale_grace,
+            expires_at + self.stale_grace,
+            current_time,
+        ]
 
     def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
         """
@@ -81,29 +397,69 @@ class RedisCache:
         # Validate and normalize TTL
         ttl = get_ttl(ttl)
 
-        cache_key = self._get_cache_key(key)
-        metadata_key = self._get_metadata_key(key)
+        current_time = time.time()
+
+        # Store the envelope and index the key for the size counter
+        self.set_script(
+            keys=[self._get_cache_key(key), self._get_metadata_key(key), self.index_key],
+            args=self._set_args(value, ttl, current_time),
+        )
+
+        return True
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Async variant of set.
 
-        # Check if key exists before setting it
-        key_exists = self.redis.exists(cache_key)
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        ttl = get_ttl(ttl)
 
         current_time = time.time()
-        expires_at = current_time + ttl
 
-        # Encode binary data and compress
-        serializable_value = encode_binary_data(value)
-        compressed_data = compress_data(serializable_value)
+        self.get_async_redis()
+        await self.async_set_script(
+            keys=[self._get_cache_key(key), self._get_metadata_key(key), self.index_key],
+            args=self._set_args(value, ttl, current_time),
+        )
+
+        return True
+
+    async def aclose(self) -> None:
+        """Close the asyncio Redis client."""
+        if self.async_redis is not None:
+            await self.async_redis.aclose()
+            self.async_redis = None
 
-        # Store the data
-        self.redis.setex(cache_key, ttl, compressed_data)
+    def set_many(self, values: Dict[str, Dict[str, Any]], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set several values with the same TTL in one pipelined round-trip.
 
-        # Store metadata
-        metadata = {"stored_at": current_time, "expires_at": expires_at}
-        self.redis.setex(metadata_key, ttl, json.dumps(metadata))
+        Args:
+            values: Maps cache keys to the values to cache
+            ttl: Time to live in seconds
 
-        # Update size counter only if this is a new key
-        if not key_exists:
-            self.redis.hincrby(self.stats_key, "size", 1)
+        Returns:
+            bool: True if successful
+        """
+        ttl = get_ttl(ttl)
+
+        current_time = time.time()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            self.set_script(
+                keys=[self._get_cache_key(key), self._get_metadata_key(key), self.index_key],
+                args=self._set_args(value, ttl, current_time),
+                client=pipe,
+            )
+        pipe.execute()
 
         return True
 
@@ -117,51 +473,44 @@ class RedisCache:
         Returns:
             bool: True if deleted, False if not found
         """
-        cache_key = self._get_cache_key(key)
-        metadata_key = self._get_metadata_key(key)
-
-        if self.redis.exists(cache_key):
-            self.redis.delete(cache_key)
-            self.redis.delete(metadata_key)
-            self.redis.hincrby(self.stats_key, "size", -1)
-            return True
-
-        return False
+        deleted = self.delete_script(keys=[self._get_cache_key(key), self._get_metadata_key(key), self.index_key])
+        return deleted > 0
 
     def delete_pattern(self, pattern: str) -> int:
         """
         Delete all keys matching a pattern.
 
+        Keys are found with incremental SCAN and removed with batched UNLINK,
+        so large keyspaces never block the server.
+
         Args:
             pattern: The pattern to match
 
         Returns:
             int: Number of keys deleted
         """
-        cache_pattern = f"{self.prefix}{pattern}"
-        metadata_pattern = f"{self.metadata_prefix}{pattern}"
-
-        # Get all matching cache keys
-        cache_keys = self.redis.keys(cache_pattern)
-        metadata_keys = self.redis.keys(metadata_pattern)
-
         count = 0
 
-        # Delete cache keys
-        if cache_keys:
-            count = len(cache_keys)
-            self.redis.delete(*cache_keys)
-
-        # Delete metadata keys
-        if metadata_keys:
-            self.redis.delete(*metadata_keys)
+        for batch in self._scan(f"{self.prefix}{pattern}"):
+            metadata_keys = [self.metadata_prefix + key.decode("utf-8")[len(self.prefix) :] for key in batch]
 
-        # Update stats
-        if count > 0:
-            self.redis.hincrby(self.stats_key, "size", -count)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.unlink(*batch)
+            pipe.unlink(*metadata_keys)
+            pipe.zrem(self.index_key, *batch)
+            count += pipe.execute()[0]
 
         return count
 
+    @staticmethod
+    def _parse_legacy_metadata(data: Optional[bytes]) -> Optional[Tuple[float, float]]:
+        """Parse a legacy metadata key into (stored_at, expires_at)."""
+        try:
+            metadata = json.loads(data)
+            return metadata["stored_at"], metadata["expires_at"]
+        except (TypeError, ValueError, KeyError):
+            return None
+
     def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
         """
         Get metadata for a cached item.
@@ -172,21 +521,44 @@ class RedisCache:
         Returns:
             Optional[Dict]: Metadata or None if not found
         """
-        metadata_key = self._get_metadata_key(key)
-        data = self.redis.get(metadata_key)
+        return self.get_metadata_many([key])[key]
 
+    def get_metadata_many(self, keys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Get metadata for several keys with a single MGET round-trip.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to its metadata or None if not found
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        values = self.redis.mget(
+            [self._get_cache_key(key) for key in keys] + [self._get_metadata_key(key) for key in keys]
+        )
+        return {
+            key: self._decode_metadata(data, metadata)
+            for key, data, metadata in zip(keys, values[: len(keys)], values[len(keys) :])
+        }
+
+    def _decode_metadata(self, data: Optional[bytes], metadata: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        """Read the metadata of a stored entry without decoding its image bytes."""
         if data is None:
             return None
 
-        try:
-            metadata = json.loads(data)
-            return {
-                "status": "hit",
-                "stored_at": datetime.fromtimestamp(metadata["stored_at"]).isoformat(),
-                "expires_at": datetime.fromtimestamp(metadata["expires_at"]).isoformat(),
-            }
-        except (json.JSONDecodeError, KeyError):
-            return None
+        if is_envelope(data):
+            unpacked = unpack_entry_header(data)
+            if unpacked is None:
+                return None
+            timestamps = unpacked[0]["stored_at"], unpacked[0]["expires_at"]
+        else:
+            timestamps = self._parse_legacy_metadata(metadata)
+
+        return format_metadata(*timestamps) if timestamps else None
 
     def clear(self) -> bool:
         """
@@ -195,18 +567,15 @@ class RedisCache:
         Returns:
             bool: True if successful
         """
-        # Get all cache keys
-        keys = self.redis.keys(f"{self.prefix}*")
-        metadata_keys = self.redis.keys(f"{self.metadata_prefix}*")
-
-        if keys:
-            self.redis.delete(*keys)
+        self.delete_pattern("*")
 
-        if metadata_keys:
-            self.redis.delete(*metadata_keys)
+        # Drop metadata left behind by entries whose data key is already gone
+        for batch in self._scan(f"{self.metadata_prefix}*"):
+            self.redis.unlink(*batch)
 
-        # Reset stats
-        self.redis.hset(self.stats_key, "size", 0)
+        # The keyspace is empty, so the index is complete even though Redis drops the empty key
+        self.redis.unlink(self.index_key)
+        self.redis.set(self.index_ready_key, 1)
 
         return True
 
@@ -217,10 +586,14 @@ class RedisCache:
         Returns:
             Dict[str, int]: Cache statistics
         """
-        # Periodically recalculate size to ensure accuracy
-        self._recalculate_size()
-
-        stats = self.redis.hgetall(self.stats_key)
-
-        # Convert bytes to strings and values to integers
-        return {k.decode("utf-8"): int(v) for k, v in stats.items()}
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.stats_key)
+        pipe.zcount(self.index_key, time.time(), "+inf")
+        stats, size = pipe.execute()
+
+        # Convert bytes to strings and values to integers, adding what this worker has not flushed yet
+        stats = {k.decode("utf-8"): int(v) for k, v in stats.items()}
+        for field, amount in self.counters.pending().items():
+            stats[field] = stats.get(field, 0) + amount
+        stats["size"] = size
+        return stats
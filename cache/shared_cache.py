@@ -0,0 +1,517 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+from cache.base import BaseCache
+from cache.utils import format_metadata, get_ttl, pack_entry, unpack_entry
+from config import Config
+
+MAGIC = b"WISPSHM1"
+VERSION = 2
+RECORD_MAGIC = b"WREC"
+
+# magic, version, bucket count, arena size, write position, sequence
+HEADER = struct.Struct("<8sIIQQQ")
+# hits, misses, evictions, size, bytes of the buckets behind one lock stripe
+STRIPE_STATS = struct.Struct("<qqqqq")
+# key hash (0 = empty), record sequence, arena offset, record length, stored_at, expires_at
+SLOT = struct.Struct("<QQQIdd4x")
+# magic, key length, payload length, record sequence, CRC-32 of key and payload
+RECORD = struct.Struct("<4sIIQI")
+COUNTER = struct.Struct("<Q")
+STAT = struct.Struct("<q")
+
+# Offsets of the mutable header fields, updated under ALLOC_LOCK
+WRITE_POS = 24
+SEQUENCE = 32
+
+# Indexes of the per-stripe counters, each updated under its stripe lock
+HITS = 0
+MISSES = 1
+EVICTIONS = 2
+SIZE = 3
+BYTES = 4
+
+WAYS = 8
+LOCK_STRIPES = 256
+ALLOC_LOCK = LOCK_STRIPES
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    Cache shared by every worker on a host through a memory-mapped file.
+
+    The file holds a set-associative index (``WAYS`` slots per bucket) and a
+    ring-buffer arena. Writers append records to the arena and then publish
+    them in the index under a per-stripe lock. Records are written outside
+    any lock, so readers check the copied record's sequence number and
+    checksum; a record the ring wrapping around has overwritten, even partly,
+    is dropped from the index and treated as a miss. Statistics are kept per
+    lock stripe as entries come and go. Records hold
+    the same binary entry envelope RedisCache uses. Locks are ``fcntl``
+    byte-range locks paired with a thread lock, which makes them work
+    across forked gunicorn workers and threads alike.
+    """
+
+    def __init__(self, path: Optional[str] = None, size: Optional[int] = None, slots: Optional[int] = None):
+        """
+        Initialize the shared cache, creating or attaching to the backing file.
+
+        Args:
+            path: Path of the backing file, preferably on tmpfs
+            size: Size of the data arena in bytes
+            slots: Number of index slots
+        """
+        self.path = path or Config.CACHE_SHARED_PATH
+        self.arena_size = size or Config.CACHE_SHARED_SIZE
+        self.bucket_count = max((slots or Config.CACHE_SHARED_SLOTS) // WAYS, 1)
+        self.prefix = "wisp:cache:"
+        self.stale_grace = Config.CACHE_STALE_GRACE
+
+        self.stats_start = HEADER.size
+        self.index_start = self.stats_start + LOCK_STRIPES * STRIPE_STATS.size
+        self.arena_start = self.index_start + self.bucket_count * WAYS * SLOT.size
+        self.file_size = self.arena_start + self.arena_size
+
+        self._reset_locks()
+        self._attach()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self) -> None:
+        """Create fresh thread locks, used at start-up and after a fork."""
+        self.thread_locks = [threading.Lock() for _ in range(ALLOC_LOCK + 1)]
+
+    def _attach(self) -> None:
+        """
+        Map the backing file, creating it if needed.
+
+        A file with another size or layout may still be mapped by workers of an
+        earlier deployment, so it is never truncated or overwritten in place: a
+        new file is built next to it and renamed over it, and those workers keep
+        their own mapping until they exit.
+        """
+        self.fd = None
+        while self.fd is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # Retry if another worker replaced the file while we waited for the lock
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    self.fd = fd
+                    self._map()
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+            # Not the file we use, either outdated or replaced by _map
+            if self.fd != fd:
+                os.close(fd)
+
+    def _map(self) -> None:
+        """Map the open backing file, the caller holds its start-up lock."""
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            # A file this worker just created, nobody has it mapped yet
+            self.mm = self._initialize(self.fd)
+            return
+
+        if size == self.file_size:
+            mm = mmap.mmap(self.fd, self.file_size)
+            if HEADER.unpack_from(mm, 0)[:4] == (MAGIC, VERSION, self.bucket_count, self.arena_size):
+                self.mm = mm
+                return
+            mm.close()
+
+        self._replace()
+
+    def _initialize(self, fd: int) -> mmap.mmap:
+        """Size an empty file for this layout, write its header and map it."""
+        os.ftruncate(fd, self.file_size)
+        self._reserve(fd)
+        mm = mmap.mmap(fd, self.file_size)
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, self.bucket_count, self.arena_size, 0, 0)
+        return mm
+
+    def _replace(self) -> None:
+        """Swap a backing file of another layout for a new one, leaving the old one to its workers."""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            mm = self._initialize(fd)
+        except BaseException:
+            os.close(fd)
+            os.unlink(temp_path)
+            raise
+
+        # No worker of the old file is reserving space while it is replaced
+        with self._locked(ALLOC_LOCK):
+            os.rename(temp_path, self.path)
+
+        self.fd = fd
+        self.mm = mm
+
+    def _reserve(self, fd: int) -> None:
+        """
+        Allocate the whole backing file up front.
+
+        A sparse file on a tmpfs that is too small would only fail once the
+        arena fills up, with a SIGBUS in whichever worker touches the missing
+        page. Allocating now turns that into an error at start-up.
+        """
+        try:
+            os.posix_fallocate(fd, 0, self.file_size)
+        except OSError as e:
+            raise OSError(
+                e.errno,
+                f"{self.path} cannot hold the {self.file_size} byte shared cache, "
+                "enlarge its file system (Docker shm_size) or lower CACHE_SHARED_SIZE",
+            ) from e
+
+    @contextmanager
+    def _locked(self, lock_id: int):
+        """Hold the thread lock and the file range lock with the given id."""
+        with self.thread_locks[lock_id]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, lock_id)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, lock_id)
+
+    def _get_cache_key(self, key: str) -> str:
+        """Get the full cache key with prefix."""
+        return f"{self.prefix}{key}"
+
+    @staticmethod
+    def _hash(cache_key: bytes) -> int:
+        """Get a process-independent, non-zero 64-bit hash of the key."""
+        return int.from_bytes(hashlib.blake2b(cache_key, digest_size=8).digest(), "little") or 1
+
+    def _slot_offset(self, bucket: int, way: int) -> int:
+        """Get the file offset of an index slot."""
+        return self.index_start + (bucket * WAYS + way) * SLOT.size
+
+    def _read_record(self, slot: Tuple) -> Optional[Tuple[bytes, bytes]]:
+        """
+        Copy a record out of the arena and check it was not overwritten, before or while copying.
+
+        Args:
+            slot: The unpacked index slot pointing at the record
+
+        Returns:
+            Optional[Tuple[bytes, bytes]]: (key, payload) or None if the record is gone
+        """
+        _, sequence, offset, length = slot[:4]
+        start = self.arena_start + offset
+        if offset + length > self.arena_size:
+            return None
+
+        magic, key_len, payload_len, record_sequence, checksum = RECORD.unpack_from(self.mm, start)
+        if magic != RECORD_MAGIC or record_sequence != sequence or RECORD.size + key_len + payload_len != length:
+            return None
+
+        body = self.mm[start + RECORD.size : start + length]
+
+        # A writer that wrapped around may have reserved space over the middle of the record only
+        if zlib.crc32(body) != checksum:
+            return None
+
+        return body[:key_len], body[key_len:]
+
+    def _find(self, bucket: int, key_hash: int) -> Optional[Tuple[int, Tuple]]:
+        """Find the way and slot of a key in its bucket, the caller holds the stripe lock."""
+        for way in range(WAYS):
+            slot = SLOT.unpack_from(self.mm, self._slot_offset(bucket, way))
+            if slot[0] == key_hash:
+                return way, slot
+        return None
+
+    def _clear_slot(self, bucket: int, way: int, slot: Tuple) -> None:
+        """Empty an index slot and update the size counters, the caller holds the stripe lock."""
+        offset = self._slot_offset(bucket, way)
+        self.mm[offset : offset + SLOT.size] = bytes(SLOT.size)
+        self._count(bucket % LOCK_STRIPES, SIZE, -1)
+        self._count(bucket % LOCK_STRIPES, BYTES, -slot[3])
+
+    def _lookup(self, key: str, count: bool = False) -> Optional[Tuple[Tuple, bytes]]:
+        """
+        Look up a live entry.
+
+        Args:
+            key: The cache key
+            count: Count the lookup in the hit and miss statistics
+
+        Returns:
+            Optional[Tuple]: (slot, payload) or None if not found or past the grace window
+        """
+        cache_key = self._get_cache_key(key).encode("utf-8")
+        key_hash = self._hash(cache_key)
+        bucket = key_hash % self.bucket_count
+        stripe = bucket % LOCK_STRIPES
+
+        with self._locked(stripe):
+            entry = None
+            found = self._find(bucket, key_hash)
+            if found is not None:
+                way, slot = found
+                record = self._read_record(slot) if slot[5] + self.stale_grace >= time.time() else None
+                if record is None:
+                    self._clear_slot(bucket, way, slot)
+                elif record[0] == cache_key:
+                    entry = slot, record[1]
+
+            if count:
+                self._count(stripe, HITS if entry is not None else MISSES)
+
+        return entry
+
+    def _count(self, stripe: int, field: int, amount: int = 1) -> None:
+        """Add to a counter of a lock stripe, the caller holds the stripe lock."""
+        offset = self.stats_start + stripe * STRIPE_STATS.size + field * STAT.size
+        (value,) = STAT.unpack_from(self.mm, offset)
+        STAT.pack_into(self.mm, offset, value + amount)
+
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata in a single lookup.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        return self._read(key, count=True)
+
+    def peek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys without counting them in the hit and miss statistics.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        return {key: self._read(key, count=False) for key in keys}
+
+    def _read(self, key: str, count: bool) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Look up and decode an entry.
+
+        Args:
+            key: The cache key
+            count: Count the lookup in the hit and miss statistics
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        entry = self._lookup(key, count)
+        if entry is None:
+            return None, None
+
+        slot, payload = entry
+        entry = unpack_entry(payload)
+        if entry is None:
+            return None, None
+
+        return entry[0], format_metadata(slot[4], slot[5])
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set a value in the cache.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful, False if the entry is too large
+        """
+        # Validate and normalize TTL
+        ttl = get_ttl(ttl)
+
+        cache_key = self._get_cache_key(key).encode("utf-8")
+        key_hash = self._hash(cache_key)
+        bucket = key_hash % self.bucket_count
+
+        current_time = time.time()
+        expires_at = current_time + ttl
+
+        payload = pack_entry(value, current_time, expires_at)
+        length = RECORD.size + len(cache_key) + len(payload)
+        if length > self.arena_size // 4:
+            return False
+
+        # Reserve space in the ring, wrapping to the start when the tail is too short
+        with self._locked(ALLOC_LOCK):
+            (offset,) = COUNTER.unpack_from(self.mm, WRITE_POS)
+            (sequence,) = COUNTER.unpack_from(self.mm, SEQUENCE)
+            if offset + length > self.arena_size:
+                offset = 0
+            sequence += 1
+            COUNTER.pack_into(self.mm, WRITE_POS, offset + length)
+            COUNTER.pack_into(self.mm, SEQUENCE, sequence)
+
+        start = self.arena_start + offset
+        key_start = start + RECORD.size
+        checksum = zlib.crc32(payload, zlib.crc32(cache_key))
+        RECORD.pack_into(self.mm, start, RECORD_MAGIC, len(cache_key), len(payload), sequence, checksum)
+        self.mm[key_start : key_start + len(cache_key)] = cache_key
+        self.mm[key_start + len(cache_key) : start + length] = payload
+
+        stripe = bucket % LOCK_STRIPES
+        with self._locked(stripe):
+            found = self._find(bucket, key_hash)
+            if found is not None:
+                way, old = found
+            else:
+                slots = [SLOT.unpack_from(self.mm, self._slot_offset(bucket, w)) for w in range(WAYS)]
+                free = [w for w, slot in enumerate(slots) if slot[0] == 0 or slot[5] + self.stale_grace < current_time]
+                # Evict the oldest record of the bucket when every way is live
+                way = free[0] if free else min(range(WAYS), key=lambda w: slots[w][1])
+                old = slots[way]
+                if not free:
+                    self._count(stripe, EVICTIONS)
+
+            SLOT.pack_into(
+                self.mm, self._slot_offset(bucket, way), key_hash, sequence, offset, length, current_time, expires_at
+            )
+            self._count(stripe, SIZE, 0 if old[0] else 1)
+            self._count(stripe, BYTES, length - old[3])
+
+        return True
+
+    def delete(self, key: str) -> bool:
+        """
+        Delete a value from the cache.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            bool: True if deleted, False if not found
+        """
+        cache_key = self._get_cache_key(key).encode("utf-8")
+        key_hash = self._hash(cache_key)
+        bucket = key_hash % self.bucket_count
+
+        with self._locked(bucket % LOCK_STRIPES):
+            found = self._find(bucket, key_hash)
+            if found is None:
+                return False
+
+            way, slot = found
+            self._clear_slot(bucket, way, slot)
+
+        return slot[5] + self.stale_grace >= time.time()
+
+    def _live_slots(self):
+        """Yield (bucket, slot, key) for every live entry, reading keys from the arena."""
+        current_time = time.time()
+        for bucket in range(self.bucket_count):
+            for way in range(WAYS):
+                slot = SLOT.unpack_from(self.mm, self._slot_offset(bucket, way))
+                if slot[0] == 0 or slot[5] + self.stale_grace < current_time:
+                    continue
+
+                record = self._read_record(slot)
+                if record is not None:
+                    yield bucket, slot, record[0].decode("utf-8")
+
+    def delete_pattern(self, pattern: str) -> int:
+        """
+        Delete all keys matching a pattern.
+
+        Args:
+            pattern: The pattern to match
+
+        Returns:
+            int: Number of keys deleted
+        """
+        pattern = pattern.replace("*", ".*")
+        regex = re.compile(f"{self.prefix}{pattern}")
+
+        keys_to_delete = [key for _, _, key in self._live_slots() if regex.match(key)]
+        count = 0
+
+        for key in keys_to_delete:
+            # Extract the original key without prefix
+            if self.delete(key[len(self.prefix) :]):
+                count += 1
+
+        return count
+
+    def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get metadata for a cached item.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: Metadata or None if not found
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+
+        slot = entry[0]
+        return format_metadata(slot[4], slot[5])
+
+    def clear(self) -> bool:
+        """
+        Clear all cache data.
+
+        Returns:
+            bool: True if successful
+        """
+        empty_bucket = bytes(WAYS * SLOT.size)
+        for stripe in range(LOCK_STRIPES):
+            with self._locked(stripe):
+                for bucket in range(stripe, self.bucket_count, LOCK_STRIPES):
+                    offset = self._slot_offset(bucket, 0)
+                    self.mm[offset : offset + len(empty_bucket)] = empty_bucket
+                counters = self._stripe_stats(stripe)
+                self._count(stripe, SIZE, -counters[SIZE])
+                self._count(stripe, BYTES, -counters[BYTES])
+
+        return True
+
+    def _stripe_stats(self, stripe: int) -> Tuple[int, ...]:
+        """Get the counters of a lock stripe."""
+        return STRIPE_STATS.unpack_from(self.mm, self.stats_start + stripe * STRIPE_STATS.size)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Get cache statistics.
+
+        Size and bytes count the indexed entries. Expired entries and records
+        the ring has overwritten are counted until their slot is next looked
+        up or reused.
+
+        Returns:
+            Dict[str, int]: Cache statistics
+        """
+        counters = STRIPE_STATS.iter_unpack(self.mm[self.stats_start : self.index_start])
+        totals = [sum(column) for column in zip(*counters)]
+
+        return {
+            "hits": totals[HITS],
+            "misses": totals[MISSES],
+            "size": totals[SIZE],
+            "bytes": totals[BYTES],
+            "evictions": totals[EVICTIONS],
+            "capacity_bytes": self.arena_size,
+        }
@@ -0,0 +1,73 @@
+from typing import Hashable
+
+# Multipliers used to derive independent row indexes from a single hash
+SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5)
+COUNTER_MAX = 15
+
+
+class FrequencySketch:
+    """
+    Count-min sketch used as the TinyLFU frequency estimator.
+
+    Counters are 4-bit (saturating at 15) and are halved after a sample of
+    ``10 * width`` increments so that popularity decays over time.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Initialize the sketch.
+
+        Args:
+            capacity: The expected number of distinct hot keys
+        """
+        width = 16
+        while width < max(capacity, 1):
+            width <<= 1
+
+        self.width = width
+        self.mask = width - 1
+        self.table = [bytearray(width) for _ in SEEDS]
+        self.sample_size = 10 * width
+        self.additions = 0
+
+    def _indexes(self, key: Hashable):
+        """Get the counter index of the key in every row."""
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        for seed in SEEDS:
+            yield ((h * seed) & 0xFFFFFFFFFFFFFFFF) >> 40 & self.mask
+
+    def increment(self, key: Hashable) -> None:
+        """
+        Record an access to the key.
+
+        Args:
+            key: The accessed key
+        """
+        added = False
+        for row, index in zip(self.table, self._indexes(key)):
+            if row[index] < COUNTER_MAX:
+                row[index] += 1
+                added = True
+
+        if added:
+            self.additions += 1
+            if self.additions >= self.sample_size:
+                self._reset()
+
+    def frequency(self, key: Hashable) -> int:
+        """
+        Estimate how often the key has been accessed recently.
+
+        Args:
+            key: The key to look up
+
+        Returns:
+            int: The estimated access frequency
+        """
+        return min(row[index] for row, index in zip(self.table, self._indexes(key)))
+
+    def _reset(self) -> None:
+        """Halve every counter to age out old popularity."""
+        for i, row in enumerate(self.table):
+            self.table[i] = bytearray(count >> 1 for count in row)
+        self.additions //= 2
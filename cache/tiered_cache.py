@@ -0,0 +1,493 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import redis
+
+from cache.base import BaseCache
+from cache.memory_cache import MemoryCache
+from cache.redis_cache import RedisCache
+from cache.utils import PeriodicTask, format_metadata, get_blob_key, get_ttl
+from config import Config
+
+INVALIDATION_CHANNEL = "wisp:cache:invalidate"
+
+
+class TieredCache(BaseCache):
+    """
+    Two-tier cache: a small in-process MemoryCache (L1) in front of RedisCache (L2).
+
+    L1 holds decoded entries for at most ``CACHE_L1_TTL`` seconds. Writes and
+    deletes are published on a Redis pub/sub channel and every worker drops
+    the affected keys from its own L1, so invalidation reaches all of them.
+    """
+
+    def __init__(self):
+        """Initialize both tiers and the invalidation listener."""
+        self.l2 = RedisCache()
+        self.redis = self.l2.redis
+        self.l1 = MemoryCache(
+            max_entries=Config.CACHE_L1_MAX_ENTRIES,
+            max_bytes=Config.CACHE_L1_MAX_BYTES,
+            store_raw=True,
+            max_ttl=Config.CACHE_L1_TTL,
+            stale_grace=0,
+        )
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+        self.stats_lock = threading.Lock()
+        self.sender = uuid.uuid4().hex
+        self.pubsub = None
+        self.listener = PeriodicTask(self._drain_invalidations, 0.05, "wisp-cache-invalidation")
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        """Drop state inherited from the parent process after a fork."""
+        self.sender = uuid.uuid4().hex
+        self.pubsub = None
+        self.stats_lock = threading.Lock()
+
+    def _count(self, field: str) -> None:
+        """Increment a local hit/miss counter."""
+        with self.stats_lock:
+            self.stats[field] += 1
+
+    def _publish(self, op: str, **fields) -> None:
+        """Tell the other workers to drop entries from their L1."""
+        message = json.dumps({"op": op, "sender": self.sender, **fields})
+        try:
+            self.redis.publish(INVALIDATION_CHANNEL, message)
+        except redis.RedisError:
+            pass
+
+    def get_async_redis(self) -> "redis.asyncio.Redis":
+        """
+        Get the asyncio Redis client of the running event loop.
+
+        Returns:
+            redis.asyncio.Redis: The L2 client
+        """
+        return self.l2.get_async_redis()
+
+    async def _apublish(self, op: str, **fields) -> None:
+        """Async variant of _publish."""
+        message = json.dumps({"op": op, "sender": self.sender, **fields})
+        try:
+            await self.get_async_redis().publish(INVALIDATION_CHANNEL, message)
+        except redis.RedisError:
+            pass
+
+    def _drain_invalidations(self) -> None:
+        """Apply invalidation messages from other workers, waiting up to a second for one."""
+        if self.pubsub is None:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            self.pubsub = pubsub
+            # Messages may have been missed while we were not subscribed
+            self.l1.clear()
+
+        try:
+            message = self.pubsub.get_message(timeout=1.0)
+            while message is not None:
+                self._apply_invalidation(message["data"])
+                message = self.pubsub.get_message(timeout=0)
+        except redis.RedisError:
+            self.pubsub = None
+
+    def _apply_invalidation(self, data: bytes) -> None:
+        """Apply one invalidation message to the local L1."""
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+
+        if message.get("sender") == self.sender:
+            return
+
+        if message["op"] == "delete":
+            self.l1.delete(message["key"])
+        elif message["op"] == "delete_pattern":
+            self.l1.delete_pattern(message["pattern"])
+        elif message["op"] == "clear":
+            self.l1.clear()
+
+    def _get_l1(self, key: str, count: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Get an L1 entry, ignoring it if the L2 entry it mirrors has expired.
+
+        L1 only copies the outer entry on a hit, so the mirrored value and
+        metadata are copied here; callers may change them without touching L1.
+        """
+        self.listener.ensure_started()
+        entry = self.l1.get(key) if count else self.l1.peek_many_with_metadata([key])[key][0]
+        if entry is None or entry["expires_at"] < time.time():
+            return None
+
+        entry["value"] = dict(entry["value"]) if entry["value"] is not None else None
+        entry["metadata"] = dict(entry["metadata"])
+        return entry
+
+    def _set_l1(self, key: str, value: Dict[str, Any], metadata: Dict[str, Any]) -> None:
+        """Mirror an L2 entry and its metadata into L1, unless it is stale and L1 would never serve it."""
+        if metadata.get("status") == "stale":
+            return
+
+        expires_at = datetime.fromisoformat(metadata["expires_at"]).timestamp()
+        self.l1.set(key, {"value": value, "metadata": metadata, "expires_at": expires_at})
+
+    def get_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value and its metadata, from L1 if possible and from L2 otherwise.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        entry = self._get_l1(key)
+        if entry is not None:
+            self._count("l1_hits")
+            return entry["value"], entry["metadata"]
+
+        value, metadata = self.l2.get_with_metadata(key)
+        if value is None:
+            self._count("misses")
+            return None, None
+
+        self._count("l2_hits")
+        if metadata is not None:
+            self._set_l1(key, value, metadata)
+
+        return value, metadata
+
+    async def aget_with_metadata(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Async variant of get_with_metadata, only the L2 lookup awaits.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata), both None if not found
+        """
+        entry = self._get_l1(key)
+        if entry is not None:
+            self._count("l1_hits")
+            return entry["value"], entry["metadata"]
+
+        value, metadata = await self.l2.aget_with_metadata(key)
+        if value is None:
+            self._count("misses")
+            return None, None
+
+        self._count("l2_hits")
+        if metadata is not None:
+            self._set_l1(key, value, metadata)
+
+        return value, metadata
+
+    def get_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys, fetching all L1 misses from L2 at once.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        results = {}
+        l1_misses = []
+
+        for key in keys:
+            entry = self._get_l1(key)
+            if entry is None:
+                l1_misses.append(key)
+                continue
+
+            self._count("l1_hits")
+            results[key] = entry["value"], entry["metadata"]
+
+        for key, (value, metadata) in self.l2.get_many_with_metadata(l1_misses).items():
+            results[key] = value, metadata
+            if value is None:
+                self._count("misses")
+                continue
+
+            self._count("l2_hits")
+            if metadata is not None:
+                self._set_l1(key, value, metadata)
+
+        return results
+
+    def peek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Get values and metadata for several keys without counting them, fetching all L1 misses from L2 at once.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        results = {}
+        l1_misses = []
+
+        for key in keys:
+            entry = self._get_l1(key, count=False)
+            if entry is None:
+                l1_misses.append(key)
+            else:
+                results[key] = entry["value"], entry["metadata"]
+
+        for key, (value, metadata) in self.l2.peek_many_with_metadata(l1_misses).items():
+            results[key] = value, metadata
+            if value is not None and metadata is not None:
+                self._set_l1(key, value, metadata)
+
+        return results
+
+    async def apeek_many_with_metadata(
+        self, keys: Iterable[str]
+    ) -> Dict[str, Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Async variant of peek_many_with_metadata, only the L2 lookup awaits.
+
+        Args:
+            keys: The cache keys
+
+        Returns:
+            Dict: Maps every key to (value, metadata), both None if not found
+        """
+        results = {}
+        l1_misses = []
+
+        for key in keys:
+            entry = self._get_l1(key, count=False)
+            if entry is None:
+                l1_misses.append(key)
+            else:
+                results[key] = entry["value"], entry["metadata"]
+
+        for key, (value, metadata) in (await self.l2.apeek_many_with_metadata(l1_misses)).items():
+            results[key] = value, metadata
+            if value is not None and metadata is not None:
+                self._set_l1(key, value, metadata)
+
+        return results
+
+    def get_with_blob(
+        self, key: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Get a value, its metadata and the blob it refers to, from L1 if possible and from L2 otherwise.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata, blob), the blob is None if the value has none or it is missing
+        """
+        entry = self._get_l1(key)
+        if entry is not None:
+            self._count("l1_hits")
+            return entry["value"], entry["metadata"], self._peek_blob(entry["value"])
+
+        value, metadata, blob = self.l2.get_with_blob(key)
+        return self._mirror_with_blob(key, value, metadata, blob)
+
+    async def aget_with_blob(
+        self, key: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Async variant of get_with_blob, only the L2 lookup awaits.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Tuple: (value, metadata, blob), the blob is None if the value has none or it is missing
+        """
+        entry = self._get_l1(key)
+        if entry is not None:
+            self._count("l1_hits")
+            return entry["value"], entry["metadata"], await self._apeek_blob(entry["value"])
+
+        value, metadata, blob = await self.l2.aget_with_blob(key)
+        return self._mirror_with_blob(key, value, metadata, blob)
+
+    def _peek_blob(self, value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Get the blob of a pointer record found in L1."""
+        blob_key = get_blob_key(value)
+        return self.peek_many_with_metadata([blob_key])[blob_key][0] if blob_key else None
+
+    async def _apeek_blob(self, value: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Async variant of _peek_blob."""
+        blob_key = get_blob_key(value)
+        return (await self.apeek_many_with_metadata([blob_key]))[blob_key][0] if blob_key else None
+
+    def _mirror_with_blob(
+        self,
+        key: str,
+        value: Optional[Dict[str, Any]],
+        metadata: Optional[Dict[str, Any]],
+        blob: Optional[Dict[str, Any]],
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Count an L2 lookup made with get_with_blob and mirror the entry into L1."""
+        if value is None:
+            self._count("misses")
+            return None, None, None
+
+        self._count("l2_hits")
+        if metadata is not None:
+            self._set_l1(key, value, metadata)
+
+        return value, metadata, blob
+
+    def set(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set a value in the cache.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        current_time = time.time()
+        self.l2.set(key, value, ttl)
+        self._publish("delete", key=key)
+
+        self._set_l1(key, value, format_metadata(current_time, current_time + get_ttl(ttl)))
+
+        return True
+
+    async def aset(self, key: str, value: Dict[str, Any], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Async variant of set.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        current_time = time.time()
+        await self.l2.aset(key, value, ttl)
+        await self._apublish("delete", key=key)
+
+        self._set_l1(key, value, format_metadata(current_time, current_time + get_ttl(ttl)))
+
+        return True
+
+    async def aclose(self) -> None:
+        """Close the L2 asyncio Redis client."""
+        await self.l2.aclose()
+
+    def set_many(self, values: Dict[str, Dict[str, Any]], ttl: Optional[Union[int, str]] = None) -> bool:
+        """
+        Set several values with the same TTL.
+
+        Args:
+            values: Maps cache keys to the values to cache
+            ttl: Time to live in seconds
+
+        Returns:
+            bool: True if successful
+        """
+        current_time = time.time()
+        self.l2.set_many(values, ttl)
+
+        metadata = format_metadata(current_time, current_time + get_ttl(ttl))
+        for key, value in values.items():
+            self._publish("delete", key=key)
+            self._set_l1(key, value, metadata)
+
+        return True
+
+    def delete(self, key: str) -> bool:
+        """
+        Delete a value from the cache.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            bool: True if deleted, False if not found
+        """
+        self.l1.delete(key)
+        deleted = self.l2.delete(key)
+        self._publish("delete", key=key)
+        return deleted
+
+    def delete_pattern(self, pattern: str) -> int:
+        """
+        Delete all keys matching a pattern.
+
+        Args:
+            pattern: The pattern to match
+
+        Returns:
+            int: Number of keys deleted
+        """
+        self.l1.delete_pattern(pattern)
+        count = self.l2.delete_pattern(pattern)
+        self._publish("delete_pattern", pattern=pattern)
+        return count
+
+    def get_metadata(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get metadata for a cached item.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            Optional[Dict]: Metadata or None if not found
+        """
+        entry = self._get_l1(key)
+        if entry is not None:
+            return entry["metadata"]
+
+        return self.l2.get_metadata(key)
+
+    def clear(self) -> bool:
+        """
+        Clear all cache data.
+
+        Returns:
+            bool: True if successful
+        """
+        self.l1.clear()
+        self.l2.clear()
+        self._publish("clear")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics.
+
+        Returns:
+            Dict[str, Any]: Cache statistics, L1 counters are per worker
+        """
+        with self.stats_lock:
+            stats = dict(self.stats)
+
+        stats["hits"] = stats["l1_hits"] + stats["l2_hits"]
+        stats["l1"] = self.l1.get_stats()
+        stats["l2"] = self.l2.get_stats()
+        return stats
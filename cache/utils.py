@@ -1,11 +1,41 @@
+import atexit
 import base64
 import functools
 import json
+import os
+import struct
+import threading
+import time
 import zlib
-from typing import Any, Dict, Optional, Union
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple, Union
 
 from config import Config
 
+# Rough per-entry bookkeeping cost (dict, timestamps, key object) in bytes
+ENTRY_OVERHEAD = 256
+
+# Binary entry envelope: magic, version, flags, header length, then the header and the raw image bytes
+ENVELOPE_MAGIC = b"WSPE"
+ENVELOPE_VERSION = 1
+ENVELOPE = struct.Struct("<4sBBI")
+FLAG_COMPRESSED = 0x01
+FLAG_HAS_IMAGE = 0x02
+# The body is the image_hash of a blob instead of image bytes, readable without decoding the header
+FLAG_IMAGE_REF = 0x04
+
+# Key prefix of content-addressed image blobs, see DedupCache
+BLOB_PREFIX = "blob:"
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"\x00\x00\x01\x00", "image/x-icon"),
+    (b"BM", "image/bmp"),
+)
+
 
 def memoize(func):
     """Simple memoization decorator for functions with no arguments."""
@@ -21,6 +51,147 @@ def memoize(func):
     return wrapper
 
 
+class PeriodicTask:
+    """
+    Run a function every ``interval`` seconds on a daemon thread.
+
+    The thread is started lazily from the process that uses it, so objects
+    created at import time under gunicorn's ``--preload`` get their own thread
+    in every forked worker instead of a dead copy of the master's.
+    """
+
+    def __init__(self, func, interval: float, name: str):
+        """
+        Initialize the task.
+
+        Args:
+            func: The callable to run
+            interval: Seconds between runs, 0 or less disables the task
+            name: Thread name, used for debugging
+        """
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        """Forget the parent's thread and lock state after a fork."""
+        self.pid = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def wake(self) -> None:
+        """Run the function now instead of waiting for the interval to elapse."""
+        self.wakeup.set()
+
+    def ensure_started(self) -> None:
+        """Start the thread if it is not running in the current process."""
+        if self.interval <= 0 or self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name=self.name, daemon=True).start()
+
+    def _run(self) -> None:
+        """Thread body, never lets an exception kill the loop."""
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.func()
+            except Exception:
+                pass
+
+
+class CounterBuffer:
+    """
+    Per-worker counters that are flushed to a shared store in the background.
+
+    Counting only touches local memory; the flush callback runs on a daemon
+    thread every ``interval`` seconds, or sooner once ``max_events`` events
+    have accumulated, and at interpreter exit.
+    """
+
+    def __init__(self, flush, interval: float, max_events: int):
+        """
+        Initialize the buffer.
+
+        Args:
+            flush: Callable receiving a dict of field -> increment
+            interval: Seconds between flushes
+            max_events: Number of buffered events that triggers an early flush
+        """
+        self.flush_func = flush
+        self.max_events = max_events
+        self.counts = {}
+        self.events = 0
+        self.lock = threading.Lock()
+        self.task = PeriodicTask(self.flush, interval, "wisp-stats-flush")
+
+        atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        """Drop the parent's unflushed counts after a fork, the parent flushes them."""
+        self.counts = {}
+        self.events = 0
+        self.lock = threading.Lock()
+
+    def incr(self, field: str, amount: int = 1) -> None:
+        """
+        Increment a counter locally.
+
+        Args:
+            field: The counter name
+            amount: The increment
+        """
+        self.task.ensure_started()
+
+        with self.lock:
+            self.counts[field] = self.counts.get(field, 0) + amount
+            self.events += 1
+            full = self.events >= self.max_events
+
+        if full:
+            self.task.wake()
+
+    def pending(self) -> Dict[str, int]:
+        """
+        Get the counts that have not been flushed yet.
+
+        Returns:
+            Dict[str, int]: Unflushed increments by counter name
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def flush(self) -> None:
+        """Hand the buffered counts to the flush callback, keeping them if it fails."""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            self.events = 0
+
+        if not counts:
+            return
+
+        try:
+            self.flush_func(counts)
+        except Exception:
+            with self.lock:
+                for field, amount in counts.items():
+                    self.counts[field] = self.counts.get(field, 0) + amount
+
+
 def get_ttl(ttl: Optional[Union[int, str]] = None) -> int:
     """
     Get a valid TTL value within the configured bounds.
@@ -48,6 +219,50 @@ def get_ttl(ttl: Optional[Union[int, str]] = None) -> int:
     return ttl
 
 
+def estimate_size(key: str, data: Any) -> int:
+    """
+    Estimate the resident size of a cache entry in bytes.
+
+    Args:
+        key: The full cache key
+        data: The stored value
+
+    Returns:
+        int: Approximate number of bytes held by the entry
+    """
+    return ENTRY_OVERHEAD + len(key) + _value_size(data)
+
+
+def _value_size(value: Any) -> int:
+    """Approximate the payload size of a (possibly nested) cached value."""
+    if isinstance(value, dict):
+        return sum(len(field) + _value_size(item) for field, item in value.items())
+
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+
+    return 16
+
+
+def format_metadata(stored_at: float, expires_at: float) -> Dict[str, Any]:
+    """
+    Build the metadata returned for a cache hit.
+
+    Args:
+        stored_at: Unix timestamp of when the entry was stored
+        expires_at: Unix timestamp of when the entry expires
+
+    Returns:
+        Dict: Metadata with ISO formatted timestamps, the status is "stale" for
+        entries served past their expiry within the grace window
+    """
+    return {
+        "status": "stale" if expires_at < time.time() else "hit",
+        "stored_at": datetime.fromtimestamp(stored_at).isoformat(),
+        "expires_at": datetime.fromtimestamp(expires_at).isoformat(),
+    }
+
+
 def compress_data(data: Any) -> bytes:
     """
     Compress data using zlib.
@@ -118,6 +333,181 @@ def encode_binary_data(data: Dict[str, Any]) -> Dict[str, Any]:
     return result
 
 
+def freeze_binary_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy a dictionary, turning mutable binary buffers into immutable bytes.
+
+    Args:
+        data: Dictionary that may contain binary data
+
+    Returns:
+        Dict: Dictionary safe to share between cache hits
+    """
+    if not isinstance(data, dict):
+        return data
+
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, (bytearray, memoryview)):
+            result[key] = bytes(value)
+        elif isinstance(value, dict):
+            result[key] = freeze_binary_data(value)
+        else:
+            result[key] = value
+
+    return result
+
+
+def detect_content_type(data: Optional[bytes], default: str = "image/jpeg") -> str:
+    """
+    Detect the content type of image bytes from their signature.
+
+    Args:
+        data: The image bytes
+        default: Content type to use when the format is not recognized
+
+    Returns:
+        str: The content type
+    """
+    if not data:
+        return default
+
+    head = bytes(data[:16])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+
+    if head.lstrip().startswith((b"<svg", b"<?xml")):
+        return "image/svg+xml"
+
+    return default
+
+
+def get_blob_key(value: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Get the key of the blob holding the image of a pointer record.
+
+    Args:
+        value: A cached value or None
+
+    Returns:
+        Optional[str]: The blob key, or None if the value holds its image itself
+    """
+    if not value or not value.get("image_hash") or value.get("image_data") is not None:
+        return None
+    return f"{BLOB_PREFIX}{value['image_hash']}"
+
+
+def is_envelope(data: bytes) -> bool:
+    """
+    Check whether stored bytes use the binary entry envelope.
+
+    Args:
+        data: The stored bytes
+
+    Returns:
+        bool: True for envelopes, False for legacy JSON entries
+    """
+    return data[: len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+
+def pack_entry(value: Dict[str, Any], stored_at: float, expires_at: float) -> bytes:
+    """
+    Pack a cache value into the binary entry envelope.
+
+    The header (URL, timestamps, content type and any other fields) is JSON,
+    zlib compressed when compression is enabled. The image bytes follow the
+    header as-is, since image formats are already compressed. Pointer records
+    without image bytes carry their ``image_hash`` there instead.
+
+    Args:
+        value: The value to store
+        stored_at: Unix timestamp of when the entry was stored
+        expires_at: Unix timestamp of when the entry expires
+
+    Returns:
+        bytes: The packed entry
+    """
+    image_data = value.get("image_data")
+    image_ref = value.get("image_hash") if image_data is None else None
+    excluded = ("image_data", "image_url", "image_hash") if image_ref else ("image_data", "image_url")
+    fields = {k: v for k, v in value.items() if k not in excluded}
+    header = {
+        "url": value.get("image_url"),
+        "stored_at": stored_at,
+        "expires_at": expires_at,
+        "content_type": detect_content_type(image_data) if image_data else None,
+        "fields": encode_binary_data(fields),
+    }
+
+    flags = 0
+    header_bytes = json.dumps(header).encode("utf-8")
+    if Config.CACHE_COMPRESSION:
+        header_bytes = zlib.compress(header_bytes)
+        flags |= FLAG_COMPRESSED
+
+    body = b""
+    if image_data is not None:
+        body = image_data
+        flags |= FLAG_HAS_IMAGE
+    elif image_ref:
+        body = image_ref.encode("ascii")
+        flags |= FLAG_IMAGE_REF
+
+    return b"".join([ENVELOPE.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, flags, len(header_bytes)), header_bytes, body])
+
+
+def unpack_entry_header(data: bytes) -> Optional[Tuple[Dict[str, Any], int, int]]:
+    """
+    Read the header of a binary entry envelope without touching the image bytes.
+
+    Args:
+        data: The packed entry
+
+    Returns:
+        Optional[Tuple]: (header, flags, body offset) or None if the data is not a valid envelope
+    """
+    try:
+        magic, version, flags, header_len = ENVELOPE.unpack_from(data, 0)
+        if magic != ENVELOPE_MAGIC or version != ENVELOPE_VERSION:
+            return None
+
+        header_bytes = bytes(data[ENVELOPE.size : ENVELOPE.size + header_len])
+        if flags & FLAG_COMPRESSED:
+            header_bytes = zlib.decompress(header_bytes)
+
+        return json.loads(header_bytes.decode("utf-8")), flags, ENVELOPE.size + header_len
+    except (struct.error, zlib.error, ValueError):
+        return None
+
+
+def unpack_entry(data: bytes) -> Optional[Tuple[Dict[str, Any], float, float]]:
+    """
+    Unpack a binary entry envelope.
+
+    Args:
+        data: The packed entry
+
+    Returns:
+        Optional[Tuple]: (value, stored_at, expires_at) or None if the data is not a valid envelope
+    """
+    unpacked = unpack_entry_header(data)
+    if unpacked is None:
+        return None
+
+    header, flags, offset = unpacked
+    value = decode_binary_data(header["fields"])
+    value["image_url"] = header["url"]
+    value["image_data"] = bytes(data[offset:]) if flags & FLAG_HAS_IMAGE else None
+    if flags & FLAG_IMAGE_REF:
+        value["image_hash"] = bytes(data[offset:]).decode("ascii")
+
+    return value, header["stored_at"], header["expires_at"]
+
+
 def decode_binary_data(data: Dict[str, Any]) -> Dict[str, Any]:
     """
     Decode base64 encoded data in a dictionary back to binary.
@@ -11,12 +11,60 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-key-change-in-production")
 
     # cache settings
-    CACHE_TYPE = os.getenv("CACHE_TYPE", "memory")  # 'memory' or 'redis'
+    CACHE_TYPE = os.getenv("CACHE_TYPE", "memory")  # 'memory', 'shared', 'redis' or 'tiered'
     CACHE_DEFAULT_TTL = int(os.getenv("CACHE_DEFAULT_TTL", 3600))  # 1 hour
     CACHE_TTL_MIN = int(os.getenv("CACHE_TTL_MIN", 3600))  # 1 hour
     CACHE_TTL_MAX = int(os.getenv("CACHE_TTL_MAX", 2419200))  # 28 days
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))  # 0 for unbounded
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 268435456))  # 256 MB, 0 for unbounded
+    CACHE_MEMORY_RAW = os.getenv("CACHE_MEMORY_RAW", "True").lower() == "true"  # keep image bytes unencoded
+    CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", 1))  # seconds, 0 disables the sweeper
+    CACHE_SWEEP_BATCH = int(os.getenv("CACHE_SWEEP_BATCH", 500))  # max expired entries removed per sweep step
+    CACHE_SHARED_PATH = os.getenv("CACHE_SHARED_PATH", "/dev/shm/wisp-cache")  # backing file for 'shared'
+    CACHE_SHARED_SIZE = int(os.getenv("CACHE_SHARED_SIZE", 268435456))  # 256 MB data arena, must fit the path's fs
+    CACHE_SHARED_SLOTS = int(os.getenv("CACHE_SHARED_SLOTS", 65536))  # index slots (max entries)
+    CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", 1000))  # in-process tier for 'tiered'
+    CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", 67108864))  # 64 MB
+    CACHE_L1_TTL = int(os.getenv("CACHE_L1_TTL", 30))  # seconds
+    CACHE_STATS_FLUSH_INTERVAL = float(os.getenv("CACHE_STATS_FLUSH_INTERVAL", 5))  # seconds between stats flushes
+    CACHE_STATS_FLUSH_EVENTS = int(os.getenv("CACHE_STATS_FLUSH_EVENTS", 1000))  # events that force a flush
+    CACHE_STALE_GRACE = int(os.getenv("CACHE_STALE_GRACE", 3600))  # seconds expired entries are served stale
+    CACHE_NEGATIVE_TTL_NOT_FOUND = int(os.getenv("CACHE_NEGATIVE_TTL_NOT_FOUND", 300))  # seconds, 0 to disable
+    CACHE_NEGATIVE_TTL_RATE_LIMITED = int(os.getenv("CACHE_NEGATIVE_TTL_RATE_LIMITED", 120))  # seconds, 0 to disable
+    CACHE_NEGATIVE_TTL_TIMEOUT = int(os.getenv("CACHE_NEGATIVE_TTL_TIMEOUT", 30))  # seconds, 0 to disable
     CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "True").lower() == "true"
+    CACHE_DEDUP = os.getenv("CACHE_DEDUP", "True").lower() == "true"  # store each distinct image once
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
     # avatar settings
     AVATAR_TIMEOUT = int(os.getenv("AVATAR_TIMEOUT", 10000))  # 10 seconds
+    AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", 5242880))  # 5 MB, larger downloads are aborted
+    HTML_MAX_BYTES = int(os.getenv("HTML_MAX_BYTES", 2097152))  # 2 MB, profile pages are not read further
+    RESOLUTION_CACHE_SIZE = int(os.getenv("RESOLUTION_CACHE_SIZE", 1000))  # resolved avatar URLs kept per worker
+    RESOLUTION_CACHE_TTL = int(os.getenv("RESOLUTION_CACHE_TTL", 120))  # seconds, 0 to disable
+
+    # upstream http settings
+    HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 20))  # hosts with a kept-alive pool per worker
+    HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))  # idle connections kept per host
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", 1000))  # open connections per ASGI worker
+
+    # upstream fetch coalescing
+    SINGLEFLIGHT_DISTRIBUTED = os.getenv("SINGLEFLIGHT_DISTRIBUTED", "True").lower() == "true"
+    SINGLEFLIGHT_LOCK_TTL = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", 25000))  # milliseconds
+    SINGLEFLIGHT_POLL_INTERVAL = int(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 50))  # milliseconds
+
+    # batch settings
+    BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 8))  # concurrent upstream fetches per worker
+    BATCH_DEADLINE = int(os.getenv("BATCH_DEADLINE", 5000))  # milliseconds
+
+    # upstream circuit breakers
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))  # consecutive failures before opening
+    BREAKER_RESET_TIMEOUT = int(os.getenv("BREAKER_RESET_TIMEOUT", 30))  # seconds open before a trial call
+    BREAKER_LATENCY_WINDOW = int(os.getenv("BREAKER_LATENCY_WINDOW", 100))  # recent calls the timeout adapts to
+    ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", 3))  # timeout as a multiple of p95
+    ADAPTIVE_TIMEOUT_MIN = int(os.getenv("ADAPTIVE_TIMEOUT_MIN", 1000))  # milliseconds, AVATAR_TIMEOUT is the maximum
+
+    # upstream rate limits, the limits themselves are declared on the adapters in services/
+    RATE_LIMIT_DISTRIBUTED = os.getenv("RATE_LIMIT_DISTRIBUTED", "True").lower() == "true"
+    RATE_LIMIT_POLICY = os.getenv("RATE_LIMIT_POLICY", "queue").lower()  # "queue" or "fail"
+    RATE_LIMIT_MAX_WAIT = int(os.getenv("RATE_LIMIT_MAX_WAIT", 2000))  # milliseconds a queued lookup waits
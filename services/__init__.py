@@ -1,12 +1,13 @@
-from services.deviantart import DeviantArtService
+from services.async_provider import AsyncAvatarProvider
+from services.deviantart import AsyncDeviantArtService, DeviantArtService
 from services.duckduckgo import DuckDuckGoService
 from services.github import GithubService
 from services.google import GoogleService
 from services.gravatar import GravatarService
-from services.instagram import InstagramService
-from services.reddit import RedditService
-from services.twitter import TwitterService
-from services.youtube import YouTubeService
+from services.instagram import AsyncInstagramService, InstagramService
+from services.reddit import AsyncRedditService, RedditService
+from services.twitter import AsyncTwitterService, TwitterService
+from services.youtube import AsyncYouTubeService, YouTubeService
 
 
 def get_service(service_name=None):
@@ -33,6 +34,30 @@ def get_service(service_name=None):
     return services.get(service_name.lower())
 
 
+def get_async_service(service_name=None):
+    """
+    Get the async service adapter for the given service name.
+    If service_name is None, return a dictionary of all async services.
+    """
+    services = {
+        "github": AsyncAvatarProvider(GithubService(), inline=True),
+        "twitter": AsyncTwitterService(TwitterService()),
+        "instagram": AsyncInstagramService(InstagramService()),
+        "reddit": AsyncRedditService(RedditService()),
+        "youtube": AsyncYouTubeService(YouTubeService()),
+        "deviantart": AsyncDeviantArtService(DeviantArtService()),
+        "google": AsyncAvatarProvider(GoogleService(), inline=True),
+        "duckduckgo": AsyncAvatarProvider(DuckDuckGoService(), inline=True),
+        "gravatar": AsyncAvatarProvider(GravatarService(), inline=True),
+        "x": AsyncTwitterService(TwitterService()),
+    }
+
+    if service_name is None:
+        return services
+
+    return services.get(service_name.lower())
+
+
 def get_unique_services():
     """
     Get a list of unique service names, handling aliases like 'x' for 'twitter'.
@@ -0,0 +1,191 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from utils.breaker import get_breaker
+from utils.html import find_avatar_url_async, select_avatar_url_async
+from utils.http import UpstreamError, UpstreamRejected, async_conditional_download
+from utils.ratelimit import get_limiter
+
+
+class AsyncAvatarProvider:
+    """
+    Async variant of AvatarProvider, used by the ASGI entry point.
+
+    It wraps the sync adapter of the same service and reuses its name,
+    timeout, error messages and upstream limits. By default ``get_avatar_url``
+    runs the sync lookup in a thread; subclasses override it with a native
+    async lookup, and adapters that only build a URL are called inline with
+    ``inline=True``.
+    """
+
+    def __init__(self, provider, inline=False):
+        """
+        Initialize the async adapter.
+
+        Args:
+            provider (AvatarProvider): The sync adapter of the same service
+            inline (bool, optional): Call the sync ``get_avatar_url`` directly, it does no I/O
+        """
+        self.provider = provider
+        self.inline = inline
+        self.name = provider.name
+
+    @property
+    def timeout(self):
+        """
+        Upstream timeout in seconds, shared with the sync adapter.
+
+        Returns:
+            float: At most ``Config.AVATAR_TIMEOUT``
+        """
+        return self.provider.timeout
+
+    async def get_avatar_url(self, username):
+        """
+        Get the avatar URL for the given username.
+
+        Args:
+            username (str): The username to get the avatar for
+
+        Returns:
+            str: The avatar URL or None if not found
+        """
+        if self.inline:
+            return self.provider.get_avatar_url(username)
+        return await asyncio.to_thread(self.provider.get_avatar_url, username)
+
+    @asynccontextmanager
+    async def upstream(self):
+        """
+        Async variant of ``AvatarProvider.upstream``, sharing the sync adapter's breaker and limiter.
+
+        Raises:
+            UpstreamRejected: If the breaker is open or the rate limiter has no slot free
+        """
+        breaker = get_breaker(self.name)
+        if not breaker.allow():
+            raise UpstreamRejected(f"{self.name} is failing, requests to it are paused")
+
+        limiter = get_limiter(self.provider)
+        acquired, token = await limiter.acquire_async()
+        if not acquired:
+            raise UpstreamRejected(f"Too many lookups on {self.name}, try again later")
+
+        try:
+            with breaker.track():
+                yield
+        finally:
+            await limiter.release_async(token)
+
+    async def get_profile_picture(self, username, with_image=True):
+        """
+        Get the profile picture for the given username.
+
+        Args:
+            username (str): The username to get the profile picture for
+            with_image (bool, optional): Download the image, otherwise only resolve its URL
+
+        Returns:
+            tuple: (image_data, image_url, error)
+        """
+        try:
+            avatar_url = await self.get_avatar_url(username)
+
+            if not avatar_url:
+                return self.handle_error(404, f"Avatar not found for {username} on {self.name}")
+
+            image_data = (await self.download_image_conditional(avatar_url))[0] if with_image else None
+            return image_data, avatar_url, None
+
+        except UpstreamRejected as e:
+            return self.handle_error(e.status_code, str(e), local=True)
+        except UpstreamError as e:
+            return self.handle_error(e.status_code)
+        except Exception as e:
+            return self.handle_error(500, str(e))
+
+    async def download_image(self, url):
+        """
+        Download an image from the given URL.
+
+        Args:
+            url (str): The URL to download the image from
+
+        Returns:
+            bytes: The binary image data or None if error
+
+        Raises:
+            UpstreamError: If the upstream fails, or UpstreamRejected if the call was not made
+        """
+        image_data, _, _ = await self.download_image_conditional(url)
+        return image_data
+
+    async def download_image_conditional(self, url, validators=None):
+        """
+        Download an image unless it did not change since the download the validators come from.
+
+        The download goes through the service's circuit breaker and rate limiter.
+
+        Args:
+            url (str): The URL to download the image from
+            validators (dict, optional): ``etag`` and ``last_modified`` of the previous download
+
+        Returns:
+            tuple: (image_data, validators, not_modified)
+
+        Raises:
+            UpstreamError: If the upstream fails, or UpstreamRejected if the call was not made
+        """
+        async with self.upstream():
+            return await self._download(url, validators)
+
+    async def _download(self, url, validators=None):
+        """Download an image without the breaker and limiter, the caller holds them."""
+        try:
+            return await async_conditional_download(url, validators, timeout=self.timeout)
+        except UpstreamError:
+            raise
+        except Exception:
+            return None, {}, False
+
+    def handle_error(self, status_code, message=None, local=False):
+        """
+        Handle error responses.
+
+        Args:
+            status_code (int): The HTTP status code
+            message (str, optional): Custom error message
+            local (bool, optional): The call was refused by our own breaker or rate limiter
+
+        Returns:
+            tuple: (None, None, error_message)
+        """
+        return self.provider.handle_error(status_code, message, local)
+
+    async def get_html_avatar(self, url, meta_property=None, css_selector=None, headers=None, img_alt=None):
+        """
+        Get avatar URL from HTML page using meta tags, image alt text or CSS selectors.
+
+        Args:
+            url (str): The URL to fetch
+            meta_property (str, optional): Meta property to look for (e.g., "og:image")
+            css_selector (str, optional): CSS selector for the image element
+            headers (dict, optional): Custom headers to use
+            img_alt (str, optional): Text the alt of the avatar image contains
+
+        Returns:
+            str: The avatar URL or None
+        """
+        if meta_property or img_alt:
+            avatar_url = await find_avatar_url_async(
+                url, meta_property, img_alt, headers, self.timeout, browser_headers=True, guard=self.upstream
+            )
+            if avatar_url:
+                return avatar_url
+
+        if css_selector:
+            avatar_url = await select_avatar_url_async(url, css_selector, headers, self.timeout, guard=self.upstream)
+            if avatar_url:
+                return avatar_url
+
+        return None
@@ -1,21 +1,84 @@
 import hashlib
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from urllib.parse import urlparse
 
-import requests
+from utils.breaker import get_breaker
+from utils.html import find_avatar_url, select_avatar_url
+from utils.http import UpstreamError, UpstreamRejected, conditional_download
+from utils.ratelimit import get_limiter
 
-from config import Config
-from utils.html import get_html, get_image_from_selector, get_meta_content
+
+class ProviderError(str):
+    """
+    Error message returned by providers, carrying the HTTP status class of the failure.
+
+    It is a ``str`` so existing callers can keep treating the error as a message.
+    ``local`` is set when our own circuit breaker or rate limiter refused the
+    call: it says nothing about the user and is not remembered.
+    """
+
+    def __new__(cls, message, status_code=500, local=False):
+        error = super().__new__(cls, message)
+        error.status_code = status_code
+        error.local = local
+        return error
 
 
 class AvatarProvider(ABC):
     """
     Base class for all avatar providers.
+
+    Subclasses that scrape a site declare its upstream limits, enforced
+    across workers for every upstream call, URL lookups and image downloads
+    alike: ``rate_limit`` calls per second with bursts of ``rate_burst``, and
+    at most ``max_in_flight`` calls at once. None means no limit.
     """
 
+    rate_limit = None
+    rate_burst = None
+    max_in_flight = None
+
     def __init__(self):
         self.name = self.__class__.__name__.replace("Service", "").lower()
-        self.timeout = Config.AVATAR_TIMEOUT / 1000  # Convert to seconds
+
+    @property
+    def timeout(self):
+        """
+        Upstream timeout in seconds, adapted to the service's observed latency.
+
+        Returns:
+            float: At most ``Config.AVATAR_TIMEOUT``
+        """
+        return get_breaker(self.name).timeout()
+
+    @contextmanager
+    def upstream(self):
+        """
+        Guard upstream calls with the service's circuit breaker and rate limiter.
+
+        Upstream errors raised in the block are recorded by the breaker and re-raised.
+        Only network calls belong in the block: URL lookups served from the
+        resolution cache or built from a template would take a rate limit token
+        and record a latency sample for no request.
+
+        Raises:
+            UpstreamRejected: If the breaker is open or the rate limiter has no slot free
+        """
+        breaker = get_breaker(self.name)
+        if not breaker.allow():
+            raise UpstreamRejected(f"{self.name} is failing, requests to it are paused")
+
+        limiter = get_limiter(self)
+        acquired, token = limiter.acquire()
+        if not acquired:
+            raise UpstreamRejected(f"Too many lookups on {self.name}, try again later")
+
+        try:
+            with breaker.track():
+                yield
+        finally:
+            limiter.release(token)
 
     @abstractmethod
     def get_avatar_url(self, username):
@@ -30,16 +93,17 @@ class AvatarProvider(ABC):
         """
         pass
 
-    def get_profile_picture(self, username):
+    def get_profile_picture(self, username, with_image=True):
         """
         Get the profile picture for the given username.
 
         Args:
             username (str): The username to get the profile picture for
+            with_image (bool, optional): Download the image, otherwise only resolve its URL
 
         Returns:
             tuple: (image_data, image_url, error)
-                - image_data: The binary image data or None if error
+                - image_data: The binary image data or None if error or not downloaded
                 - image_url: The URL of the image or None if error
                 - error: Error message or None if success
         """
@@ -49,9 +113,13 @@ class AvatarProvider(ABC):
             if not avatar_url:
                 return self.handle_error(404, f"Avatar not found for {username} on {self.name}")
 
-            image_data = self.download_image(avatar_url)
+            image_data = self.download_image_conditional(avatar_url)[0] if with_image else None
             return image_data, avatar_url, None
 
+        except UpstreamRejected as e:
+            return self.handle_error(e.status_code, str(e), local=True)
+        except UpstreamError as e:
+            return self.handle_error(e.status_code)
         except Exception as e:
             return self.handle_error(500, str(e))
 
@@ -64,64 +132,97 @@ class AvatarProvider(ABC):
 
         Returns:
             bytes: The binary image data or None if error
+
+        Raises:
+            UpstreamError: If the upstream fails, or UpstreamRejected if the call was not made
+        """
+        image_data, _, _ = self.download_image_conditional(url)
+        return image_data
+
+    def download_image_conditional(self, url, validators=None):
         """
+        Download an image unless it did not change since the download the validators come from.
+
+        The download goes through the service's circuit breaker and rate limiter.
+
+        Args:
+            url (str): The URL to download the image from
+            validators (dict, optional): ``etag`` and ``last_modified`` of the previous download
+
+        Returns:
+            tuple: (image_data, validators, not_modified)
+                - image_data: The binary image data or None if not modified or error
+                - validators: The validators to send when checking the image again
+                - not_modified: True if the cached image is still current
+
+        Raises:
+            UpstreamError: If the upstream fails, or UpstreamRejected if the call was not made
+        """
+        with self.upstream():
+            return self._download(url, validators)
+
+    def _download(self, url, validators=None):
+        """Download an image without the breaker and limiter, the caller holds them."""
         try:
-            response = requests.get(url, timeout=self.timeout)
-            if response.status_code == 200:
-                return response.content
-            return None
+            return conditional_download(url, validators, timeout=self.timeout)
+        except UpstreamError:
+            raise
         except Exception:
-            return None
+            return None, {}, False
 
-    def handle_error(self, status_code, message=None):
+    def handle_error(self, status_code, message=None, local=False):
         """
         Handle error responses.
 
         Args:
             status_code (int): The HTTP status code
             message (str, optional): Custom error message
+            local (bool, optional): The call was refused by our own breaker or rate limiter
 
         Returns:
-            tuple: (None, None, error_message)
+            tuple: (None, None, error_message), the message is a ProviderError
         """
         error_messages = {
             404: f"User not found on {self.name}",
             400: f"Invalid parameters for {self.name}",
             429: f"Rate limited by {self.name}",
             503: f"{self.name} service is unavailable",
+            504: f"Timed out while accessing {self.name}",
             500: f"Internal server error while accessing {self.name}",
         }
 
         error_message = message or error_messages.get(status_code, f"Error accessing {self.name}")
-        return None, None, error_message
+        return None, None, ProviderError(error_message, status_code, local)
 
-    def get_html_avatar(self, url, meta_property=None, css_selector=None, headers=None):
+    def get_html_avatar(self, url, meta_property=None, css_selector=None, headers=None, img_alt=None):
         """
-        Get avatar URL from HTML page using meta tags or CSS selectors.
+        Get avatar URL from HTML page using meta tags, image alt text or CSS selectors.
+
+        Meta tags and alt text are matched while streaming the page, reading only
+        as much of it as needed. A CSS selector needs the whole page parsed, so it
+        is only tried when they find nothing.
 
         Args:
             url (str): The URL to fetch
             meta_property (str, optional): Meta property to look for (e.g., "og:image")
             css_selector (str, optional): CSS selector for the image element
             headers (dict, optional): Custom headers to use
+            img_alt (str, optional): Text the alt of the avatar image contains
 
         Returns:
             str: The avatar URL or None
         """
-        soup, _ = get_html(url, headers, self.timeout)
-
-        if not soup:
-            return None
-
-        # Try meta tag first if specified
-        if meta_property:
-            avatar_url = get_meta_content(soup, meta_property)
+        # Try meta tag and alt text first if specified
+        if meta_property or img_alt:
+            avatar_url = find_avatar_url(
+                url, meta_property, img_alt, headers, self.timeout, browser_headers=True, guard=self.upstream
+            )
             if avatar_url:
                 return avatar_url
 
         # Try CSS selector if specified
         if css_selector:
-            avatar_url = get_image_from_selector(soup, css_selector)
+            avatar_url = select_avatar_url(url, css_selector, headers, self.timeout, guard=self.upstream)
             if avatar_url:
                 return avatar_url
 
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 
-import requests
+from services.avatar_provider import ProviderError
+from utils.http import UpstreamError, download
 
 
 class BaseService(ABC):
@@ -38,10 +39,9 @@ class BaseService(ABC):
             bytes: The binary image data or None if error.
         """
         try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                return response.content
-            return None
+            return download(url, timeout=10)
+        except UpstreamError:
+            raise
         except Exception:
             return None
 
@@ -54,15 +54,16 @@ class BaseService(ABC):
             message (str, optional): Custom error message.
 
         Returns:
-            tuple: (None, None, error_message)
+            tuple: (None, None, error_message), the message is a ProviderError
         """
         error_messages = {
             404: f"User not found on {self.name}",
             400: f"Invalid parameters for {self.name}",
             429: f"Rate limited by {self.name}",
             503: f"{self.name} service is unavailable",
+            504: f"Timed out while accessing {self.name}",
             500: f"Internal server error while accessing {self.name}",
         }
 
         error_message = message or error_messages.get(status_code, f"Error accessing {self.name}")
-        return None, None, error_message
+        return None, None, ProviderError(error_message, status_code)
@@ -1,4 +1,6 @@
+from services.async_provider import AsyncAvatarProvider
 from services.avatar_provider import AvatarProvider
+from utils.http import UpstreamError
 
 
 class DeviantArtService(AvatarProvider):
@@ -6,6 +8,10 @@ class DeviantArtService(AvatarProvider):
     Service adapter for DeviantArt.
     """
 
+    rate_limit = 2
+    rate_burst = 5
+    max_in_flight = 4
+
     def get_avatar_url(self, username):
         """
         Get the DeviantArt avatar URL for the given username.
@@ -18,5 +24,30 @@ class DeviantArtService(AvatarProvider):
         """
         try:
             return self.get_html_avatar(f"https://www.deviantart.com/{username}", meta_property="og:image")
+        except UpstreamError:
+            raise
+        except Exception:
+            return None
+
+
+class AsyncDeviantArtService(AsyncAvatarProvider):
+    """
+    Async service adapter for DeviantArt.
+    """
+
+    async def get_avatar_url(self, username):
+        """
+        Get the DeviantArt avatar URL for the given username.
+
+        Args:
+            username (str): The DeviantArt username
+
+        Returns:
+            str: The avatar URL or None if not found
+        """
+        try:
+            return await self.get_html_avatar(f"https://www.deviantart.com/{username}", meta_property="og:image")
+        except UpstreamError:
+            raise
         except Exception:
             return None
@@ -1,4 +1,6 @@
+from services.async_provider import AsyncAvatarProvider
 from services.avatar_provider import AvatarProvider
+from utils.http import UpstreamError
 
 
 class InstagramService(AvatarProvider):
@@ -6,6 +8,10 @@ class InstagramService(AvatarProvider):
     Service adapter for Instagram.
     """
 
+    rate_limit = 1
+    rate_burst = 3
+    max_in_flight = 2
+
     def get_avatar_url(self, username):
         """
         Get the Instagram avatar URL for the given username.
@@ -18,5 +24,30 @@ class InstagramService(AvatarProvider):
         """
         try:
             return self.get_html_avatar(f"https://www.instagram.com/{username}/", meta_property="og:image")
+        except UpstreamError:
+            raise
+        except Exception:
+            return None
+
+
+class AsyncInstagramService(AsyncAvatarProvider):
+    """
+    Async service adapter for Instagram.
+    """
+
+    async def get_avatar_url(self, username):
+        """
+        Get the Instagram avatar URL for the given username.
+
+        Args:
+            username (str): The Instagram username
+
+        Returns:
+            str: The avatar URL or None if not found
+        """
+        try:
+            return await self.get_html_avatar(f"https://www.instagram.com/{username}/", meta_property="og:image")
+        except UpstreamError:
+            raise
         except Exception:
             return None
@@ -1,25 +1,43 @@
-import requests
-from bs4 import BeautifulSoup
-
+from services.async_provider import AsyncAvatarProvider
 from services.avatar_provider import AvatarProvider
-from utils.html import get_image_from_selector
+from utils.html import find_avatar_url, find_avatar_url_async
+from utils.http import UpstreamError
+
+HEADERS = {"accept-language": "en"}
+
+# the avatar is the first img whose alt mentions it
+AVATAR_ALT = "avatar"
 
 
 class RedditService(AvatarProvider):
     """service adapter for reddit"""
 
+    rate_limit = 2
+    rate_burst = 5
+    max_in_flight = 4
+
     def get_avatar_url(self, username):
         """get reddit avatar url for username"""
         try:
             url = f"https://www.reddit.com/user/{username}"
+            return find_avatar_url(url, img_alt=AVATAR_ALT, headers=HEADERS, timeout=self.timeout, guard=self.upstream)
+        except UpstreamError:
+            raise
+        except Exception:
+            return None
 
-            headers = {"accept-language": "en"}
 
-            response = requests.get(url, headers=headers, timeout=self.timeout)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                return get_image_from_selector(soup, 'img[alt*="avatar"]')
+class AsyncRedditService(AsyncAvatarProvider):
+    """async service adapter for reddit"""
 
-            return None
+    async def get_avatar_url(self, username):
+        """get reddit avatar url for username"""
+        try:
+            url = f"https://www.reddit.com/user/{username}"
+            return await find_avatar_url_async(
+                url, img_alt=AVATAR_ALT, headers=HEADERS, timeout=self.timeout, guard=self.upstream
+            )
+        except UpstreamError:
+            raise
         except Exception:
             return None
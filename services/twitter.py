@@ -1,8 +1,31 @@
-import requests
-from bs4 import BeautifulSoup
-
+from services.async_provider import AsyncAvatarProvider
 from services.avatar_provider import AvatarProvider
-from utils.html import get_meta_content
+from utils.html import find_avatar_url, find_avatar_url_async
+from utils.http import UpstreamError
+
+# use slackbot user agent
+HEADERS = {"User-Agent": "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"}
+
+
+def normalize_avatar_url(avatar_url):
+    """
+    Validate the og:image of a Twitter/X profile page and upgrade it to the larger size.
+
+    Args:
+        avatar_url (str): The og:image content
+
+    Returns:
+        str: The avatar URL or None if not valid
+    """
+    # validate the avatar url
+    if not avatar_url or avatar_url.startswith("undefined"):
+        return None
+
+    # get larger image if available
+    if avatar_url and avatar_url.endswith("_200x200.jpg"):
+        avatar_url = avatar_url.replace("_200x200.jpg", "_400x400.jpg")
+
+    return avatar_url
 
 
 class TwitterService(AvatarProvider):
@@ -10,6 +33,10 @@ class TwitterService(AvatarProvider):
     Service adapter for Twitter/X.
     """
 
+    rate_limit = 2
+    rate_burst = 5
+    max_in_flight = 4
+
     def get_avatar_url(self, username):
         """
         Get the Twitter avatar URL for the given username.
@@ -22,25 +49,36 @@ class TwitterService(AvatarProvider):
         """
         try:
             url = f"https://x.com/{username}"
+            avatar_url = find_avatar_url(url, "og:image", headers=HEADERS, timeout=self.timeout, guard=self.upstream)
+            return normalize_avatar_url(avatar_url)
+        except UpstreamError:
+            raise
+        except Exception:
+            return None
 
-            # use slackbot user agent
-            headers = {"User-Agent": "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)"}
-
-            response = requests.get(url, headers=headers, timeout=self.timeout)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                avatar_url = get_meta_content(soup, "og:image")
 
-                # validate the avatar url
-                if not avatar_url or avatar_url.startswith("undefined"):
-                    return None
+class AsyncTwitterService(AsyncAvatarProvider):
+    """
+    Async service adapter for Twitter/X.
+    """
 
-                # get larger image if available
-                if avatar_url and avatar_url.endswith("_200x200.jpg"):
-                    avatar_url = avatar_url.replace("_200x200.jpg", "_400x400.jpg")
+    async def get_avatar_url(self, username):
+        """
+        Get the Twitter avatar URL for the given username.
 
-                return avatar_url
+        Args:
+            username (str): The Twitter username
 
-            return None
+        Returns:
+            str: The avatar URL or None if not found
+        """
+        try:
+            url = f"https://x.com/{username}"
+            avatar_url = await find_avatar_url_async(
+                url, "og:image", headers=HEADERS, timeout=self.timeout, guard=self.upstream
+            )
+            return normalize_avatar_url(avatar_url)
+        except UpstreamError:
+            raise
         except Exception:
             return None
@@ -1,4 +1,6 @@
+from services.async_provider import AsyncAvatarProvider
 from services.avatar_provider import AvatarProvider
+from utils.http import UpstreamError
 
 
 class YouTubeService(AvatarProvider):
@@ -6,6 +8,10 @@ class YouTubeService(AvatarProvider):
     Service adapter for YouTube.
     """
 
+    rate_limit = 5
+    rate_burst = 10
+    max_in_flight = 8
+
     def get_avatar_url(self, username):
         """
         Get the YouTube avatar URL for the given username.
@@ -18,5 +24,30 @@ class YouTubeService(AvatarProvider):
         """
         try:
             return self.get_html_avatar(f"https://www.youtube.com/@{username}", meta_property="og:image")
+        except UpstreamError:
+            raise
+        except Exception:
+            return None
+
+
+class AsyncYouTubeService(AsyncAvatarProvider):
+    """
+    Async service adapter for YouTube.
+    """
+
+    async def get_avatar_url(self, username):
+        """
+        Get the YouTube avatar URL for the given username.
+
+        Args:
+            username (str): The YouTube username
+
+        Returns:
+            str: The avatar URL or None if not found
+        """
+        try:
+            return await self.get_html_avatar(f"https://www.youtube.com/@{username}", meta_property="og:image")
+        except UpstreamError:
+            raise
         except Exception:
             return None
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import Config
+from utils.http import UpstreamError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Latency samples needed before the timeout adapts
+MIN_SAMPLES = 20
+
+
+class CircuitBreaker:
+    """
+    Per-service circuit breaker with a latency-adaptive timeout.
+
+    After ``BREAKER_FAILURE_THRESHOLD`` consecutive upstream failures the
+    breaker opens and calls fail fast. After ``BREAKER_RESET_TIMEOUT`` seconds
+    one trial call is let through (half-open). It closes the breaker again if
+    it succeeds and reopens it if it fails.
+
+    Upstream timeouts follow the service's observed latency: a multiple of the
+    recent p95, kept between ``ADAPTIVE_TIMEOUT_MIN`` and ``AVATAR_TIMEOUT``.
+    State is kept per worker process.
+    """
+
+    def __init__(self, name):
+        """
+        Initialize the breaker.
+
+        Args:
+            name (str): The service name
+        """
+        self.name = name
+        self.failure_threshold = Config.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = Config.BREAKER_RESET_TIMEOUT
+        self.max_timeout = Config.AVATAR_TIMEOUT / 1000
+        self.min_timeout = min(Config.ADAPTIVE_TIMEOUT_MIN / 1000, self.max_timeout)
+        self.latencies = deque(maxlen=Config.BREAKER_LATENCY_WINDOW)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+        self.lock = threading.Lock()
+
+    def _reset_lock(self):
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether a call to the service may go upstream.
+
+        Returns:
+            bool: False if the breaker is open and the call should fail fast
+        """
+        with self.lock:
+            now = time.time()
+
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self.trial_started_at = None
+
+            if self.state == HALF_OPEN:
+                # Let one trial through, or another one if the last never reported back
+                if self.trial_started_at is None or now - self.trial_started_at >= self.reset_timeout:
+                    self.trial_started_at = now
+                    return True
+
+            if self.state == CLOSED:
+                return True
+
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self, latency):
+        """
+        Record a call that reached the service, closing the breaker.
+
+        Args:
+            latency (float): Duration of the call in seconds
+        """
+        with self.lock:
+            self.latencies.append(latency)
+            self.stats["successes"] += 1
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.opened_at = None
+
+    def record_failure(self, latency=None):
+        """
+        Record a failed call, opening the breaker past the threshold or after a failed trial.
+
+        Args:
+            latency (float, optional): Duration of a timed out call in seconds, so a service
+                that got slower raises its timeout instead of timing out for good
+        """
+        with self.lock:
+            if latency is not None:
+                self.latencies.append(latency)
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    @contextmanager
+    def track(self):
+        """
+        Record the outcome of the upstream calls made in the block.
+
+        Upstream errors count as failures and are re-raised, other exceptions are not
+        the service's fault and are not recorded.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        except UpstreamError as e:
+            self.record_failure(time.monotonic() - started if e.status_code == 504 else None)
+            raise
+        self.record_success(time.monotonic() - started)
+
+    def _percentile(self, samples, percentile):
+        """Get a percentile of sorted samples, None if there are none."""
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * percentile / 100), len(samples) - 1)]
+
+    def timeout(self):
+        """
+        Get the upstream timeout for the next call.
+
+        Returns:
+            float: Timeout in seconds
+        """
+        with self.lock:
+            # A half-open trial gets the full timeout
+            if self.state != CLOSED:
+                return self.max_timeout
+            samples = sorted(self.latencies)
+
+        if len(samples) < MIN_SAMPLES:
+            return self.max_timeout
+
+        adaptive = self._percentile(samples, 95) * Config.ADAPTIVE_TIMEOUT_MULTIPLIER
+        return round(max(self.min_timeout, min(adaptive, self.max_timeout)), 1)
+
+    def get_stats(self):
+        """
+        Get the breaker state and latency statistics.
+
+        Returns:
+            dict: State, counters, current timeout and latency percentiles in milliseconds
+        """
+        with self.lock:
+            samples = sorted(self.latencies)
+            stats = {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opened_at": datetime.fromtimestamp(self.opened_at).isoformat() if self.opened_at else None,
+                **self.stats,
+            }
+
+        stats["timeout_ms"] = round(self.timeout() * 1000)
+        stats["latency_ms"] = {
+            f"p{percentile}": round(value * 1000) if value is not None else None
+            for percentile, value in ((p, self._percentile(samples, p)) for p in (50, 95, 99))
+        }
+        return stats
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _reset_breakers_lock():
+    """Replace the registry lock and breaker locks in a forked child."""
+    global _breakers_lock
+    _breakers_lock = threading.Lock()
+    for breaker in _breakers.values():
+        breaker._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_breakers_lock)
+
+
+def get_breaker(name):
+    """
+    Get the circuit breaker of a service, creating it on first use.
+
+    Args:
+        name (str): The service name
+
+    Returns:
+        CircuitBreaker: The breaker shared by every adapter instance of the service
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def get_breaker_stats():
+    """
+    Get the state of every breaker in this worker.
+
+    Returns:
+        dict: Breaker statistics by service name
+    """
+    return {name: breaker.get_stats() for name, breaker in sorted(_breakers.items())}
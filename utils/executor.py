@@ -0,0 +1,31 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the thread pool used for concurrent upstream fetches in this worker process.
+
+    Threads do not survive a fork, so a new pool is created in each worker.
+
+    Returns:
+        ThreadPoolExecutor: The shared pool, bounded by BATCH_MAX_WORKERS
+    """
+    global _executor, _executor_pid
+
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=Config.BATCH_MAX_WORKERS, thread_name_prefix="wisp-fetch")
+            _executor_pid = os.getpid()
+
+    return _executor
@@ -1,9 +1,20 @@
+import codecs
+import os
 import random
-from functools import lru_cache
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from html.parser import HTMLParser
 
-import requests
 from bs4 import BeautifulSoup
 
+from config import Config
+from utils.http import UpstreamError, async_http_get, async_http_stream, http_get, http_stream
+
+# Small chunks let the extractor stop soon after the tag it looks for
+HTML_CHUNK_SIZE = 16 * 1024
+
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.1.1 Safari/605.1.15",
@@ -14,23 +25,26 @@ USER_AGENTS = [
 ]
 
 
+@asynccontextmanager
+async def _unguarded():
+    """Async counterpart of ``nullcontext``, for page requests made without a guard."""
+    yield
+
+
 def get_random_user_agent():
     """Get a random user agent from the list."""
     return random.choice(USER_AGENTS)
 
 
-@lru_cache(maxsize=100)
-def get_html(url, headers=None, timeout=10):
+def get_request_headers(headers=None):
     """
-    Get HTML content from a URL and parse it with BeautifulSoup.
+    Get browser-like request headers for fetching a profile page.
 
     Args:
-        url (str): The URL to fetch
-        headers (dict, optional): Custom headers to use
-        timeout (int, optional): Request timeout in seconds
+        headers (dict, optional): Custom headers overriding the defaults
 
     Returns:
-        tuple: (BeautifulSoup object, response)
+        dict: The request headers
     """
     default_headers = {
         "User-Agent": get_random_user_agent(),
@@ -41,15 +55,423 @@ def get_html(url, headers=None, timeout=10):
     if headers:
         default_headers.update(headers)
 
+    return default_headers
+
+
+class ResolutionCache:
+    """
+    Per-worker cache of resolved avatar URLs.
+
+    Entries are keyed by request fingerprint, expire after ``ttl`` seconds and
+    the least recently used ones are evicted beyond ``maxsize``. Only URLs are
+    kept, never pages or parse trees, and failed lookups are not cached.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize (int, optional): Most entries kept, defaults to RESOLUTION_CACHE_SIZE
+            ttl (int, optional): Entry lifetime in seconds, defaults to RESOLUTION_CACHE_TTL, 0 disables the cache
+        """
+        self.maxsize = maxsize or Config.RESOLUTION_CACHE_SIZE
+        self.ttl = Config.RESOLUTION_CACHE_TTL if ttl is None else ttl
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get a resolved avatar URL.
+
+        Args:
+            key (tuple): The request fingerprint
+
+        Returns:
+            str: The avatar URL or None if not cached or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[0]
+                del self.entries[key]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, avatar_url):
+        """
+        Cache a resolved avatar URL.
+
+        Args:
+            key (tuple): The request fingerprint
+            avatar_url (str): The avatar URL
+        """
+        if not self.ttl or not avatar_url:
+            return
+
+        with self.lock:
+            self.entries[key] = (avatar_url, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_stats(self):
+        """
+        Get resolution cache statistics for this worker.
+
+        Returns:
+            dict: Hits, misses, evictions, current size and configured limits
+        """
+        with self.lock:
+            return {**self.stats, "size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl}
+
+
+resolution_cache = ResolutionCache()
+
+
+def request_fingerprint(url, headers=None, **options):
+    """
+    Build a hashable key for a page lookup.
+
+    Args:
+        url (str): The page URL
+        headers (dict, optional): Custom request headers, in any order and case
+        **options: What the lookup extracts and how
+
+    Returns:
+        tuple: The fingerprint
+    """
+    header_items = tuple(sorted((name.lower(), value) for name, value in (headers or {}).items()))
+    return url, header_items, tuple(sorted(options.items()))
+
+
+def get_html(url, headers=None, timeout=10):
+    """
+    Get HTML content from a URL and parse it with BeautifulSoup.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Custom headers to use
+        timeout (int, optional): Request timeout in seconds
+
+    Returns:
+        tuple: (BeautifulSoup object, response)
+    """
+    default_headers = get_request_headers(headers)
+
+    try:
+        response = http_get(url, headers=default_headers, timeout=timeout)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.text, "html.parser")
+        return soup, response
+    except UpstreamError:
+        raise
+    except Exception:
+        return None, None
+
+
+async def get_html_async(url, headers=None, timeout=10):
+    """
+    Async variant of get_html.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Custom headers to use
+        timeout (int, optional): Request timeout in seconds
+
+    Returns:
+        tuple: (BeautifulSoup object, response)
+    """
     try:
-        response = requests.get(url, headers=default_headers, timeout=timeout)
+        response = await async_http_get(url, headers=get_request_headers(headers), timeout=timeout)
         response.raise_for_status()
         soup = BeautifulSoup(response.text, "html.parser")
         return soup, response
+    except UpstreamError:
+        raise
     except Exception:
         return None, None
 
 
+def _image_url(src, srcset):
+    """Get the image URL of an img element from its src, or the last (largest) srcset candidate."""
+    if src:
+        return src
+
+    if srcset:
+        parts = srcset.split(",")
+        if parts:
+            return parts[-1].strip().split(" ")[0]
+
+    return None
+
+
+def _charset(content_type):
+    """Get the charset declared in a Content-Type header, or None."""
+    for param in (content_type or "").split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "charset":
+            return value.strip("\"' ") or None
+    return None
+
+
+class AvatarExtractor(HTMLParser):
+    """
+    Incremental tokenizer that finds an avatar URL without building a document tree.
+
+    It looks for the first ``<meta property=meta_property>`` and the first
+    ``<img>`` whose alt contains ``img_alt``, preferring the meta tag like
+    ``get_meta_content`` and ``get_image_from_selector`` do. Meta tags are
+    matched in the body too, as ``soup.find`` does. ``done`` turns True as soon
+    as the rest of the page cannot change the result, so the caller can stop
+    reading: at the meta tag, which pages usually put in the head.
+    """
+
+    def __init__(self, meta_property=None, img_alt=None, encoding=None):
+        """
+        Initialize the extractor.
+
+        Args:
+            meta_property (str, optional): Meta property to look for (e.g., "og:image")
+            img_alt (str, optional): Text the alt of the avatar image contains
+            encoding (str, optional): Charset of the fed bytes, defaults to UTF-8
+        """
+        super().__init__(convert_charrefs=True)
+        self.meta_property = meta_property
+        self.img_alt = img_alt
+        self.meta_url = None
+        self.img_url = None
+        self.meta_done = meta_property is None
+        self.img_done = img_alt is None
+        self.size = 0
+
+        try:
+            self.decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def done(self):
+        """Whether reading further cannot change the result."""
+        return self.meta_url is not None or (self.meta_done and self.img_done)
+
+    @property
+    def avatar_url(self):
+        """The avatar URL found so far, or None."""
+        return self.meta_url or self.img_url
+
+    def feed_bytes(self, chunk, final=False):
+        """
+        Decode and tokenize the next chunk of the page.
+
+        Args:
+            chunk (bytes): The next bytes of the page
+            final (bool, optional): True for the last chunk
+
+        Returns:
+            bool: True once the result is known
+        """
+        self.size += len(chunk)
+        self.feed(self.decoder.decode(chunk, final))
+        if final:
+            self.close()
+        return self.done
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        if tag == "meta" and not self.meta_done:
+            attrs = dict(attrs)
+            if attrs.get("property") == self.meta_property:
+                # Like soup.find, only the first matching meta tag counts
+                self.meta_url = attrs.get("content") or None
+                self.meta_done = True
+        elif tag == "img" and not self.img_done:
+            attrs = dict(attrs)
+            if self.img_alt in (attrs.get("alt") or ""):
+                self.img_url = _image_url(attrs.get("src"), attrs.get("srcset"))
+                self.img_done = True
+
+
+def find_avatar_url(url, meta_property=None, img_alt=None, headers=None, timeout=10, browser_headers=False, guard=None):
+    """
+    Stream a page and extract its avatar URL, closing the connection as soon as it is found.
+
+    Unlike get_html the page is never held or parsed as a whole, and reading
+    stops at the tag that gives the URL. Pages are read up to
+    ``HTML_MAX_BYTES``; found URLs are kept in the resolution cache unless
+    the page was cut short there.
+
+    Args:
+        url (str): The URL to fetch
+        meta_property (str, optional): Meta property to look for (e.g., "og:image")
+        img_alt (str, optional): Text the alt of the avatar image contains
+        headers (dict, optional): Request headers
+        timeout (int, optional): Request timeout in seconds
+        browser_headers (bool, optional): Send browser-like headers, ``headers`` overriding them
+        guard (callable, optional): Returns a context manager the page request runs in, an adapter's ``upstream``
+
+    Returns:
+        str: The avatar URL or None
+    """
+    key = request_fingerprint(
+        url, headers, meta_property=meta_property, img_alt=img_alt, browser_headers=browser_headers
+    )
+    avatar_url = resolution_cache.get(key)
+    if avatar_url:
+        return avatar_url
+
+    if browser_headers:
+        headers = get_request_headers(headers)
+
+    truncated = False
+    try:
+        with (guard or nullcontext)(), http_stream(url, headers=headers, timeout=timeout) as response:
+            if response.status_code != 200:
+                return None
+
+            extractor = AvatarExtractor(meta_property, img_alt, _charset(response.headers.get("Content-Type")))
+            for chunk in response.iter_content(HTML_CHUNK_SIZE):
+                if extractor.feed_bytes(chunk):
+                    break
+                if extractor.size > Config.HTML_MAX_BYTES:
+                    truncated = True
+                    break
+            else:
+                extractor.feed_bytes(b"", final=True)
+    except UpstreamError:
+        raise
+    except Exception:
+        return None
+
+    # What was found before the size limit may not be what the whole page gives
+    if not truncated:
+        resolution_cache.set(key, extractor.avatar_url)
+    return extractor.avatar_url
+
+
+async def find_avatar_url_async(
+    url, meta_property=None, img_alt=None, headers=None, timeout=10, browser_headers=False, guard=None
+):
+    """
+    Async variant of find_avatar_url.
+
+    Args:
+        url (str): The URL to fetch
+        meta_property (str, optional): Meta property to look for (e.g., "og:image")
+        img_alt (str, optional): Text the alt of the avatar image contains
+        headers (dict, optional): Request headers
+        timeout (int, optional): Request timeout in seconds
+        browser_headers (bool, optional): Send browser-like headers, ``headers`` overriding them
+        guard (callable, optional): Returns a context manager the page request runs in, an adapter's ``upstream``
+
+    Returns:
+        str: The avatar URL or None
+    """
+    key = request_fingerprint(
+        url, headers, meta_property=meta_property, img_alt=img_alt, browser_headers=browser_headers
+    )
+    avatar_url = resolution_cache.get(key)
+    if avatar_url:
+        return avatar_url
+
+    if browser_headers:
+        headers = get_request_headers(headers)
+
+    truncated = False
+    try:
+        async with (guard or _unguarded)(), async_http_stream(url, headers=headers, timeout=timeout) as response:
+            if response.status_code != 200:
+                return None
+
+            extractor = AvatarExtractor(meta_property, img_alt, _charset(response.headers.get("Content-Type")))
+            async for chunk in response.aiter_bytes(HTML_CHUNK_SIZE):
+                if extractor.feed_bytes(chunk):
+                    break
+                if extractor.size > Config.HTML_MAX_BYTES:
+                    truncated = True
+                    break
+            else:
+                extractor.feed_bytes(b"", final=True)
+    except UpstreamError:
+        raise
+    except Exception:
+        return None
+
+    # What was found before the size limit may not be what the whole page gives
+    if not truncated:
+        resolution_cache.set(key, extractor.avatar_url)
+    return extractor.avatar_url
+
+
+def select_avatar_url(url, css_selector, headers=None, timeout=10, guard=None):
+    """
+    Parse a whole page and get the image matching a CSS selector, for lookups the streaming extractor cannot do.
+
+    Found URLs are kept in the resolution cache.
+
+    Args:
+        url (str): The URL to fetch
+        css_selector (str): CSS selector for the image element
+        headers (dict, optional): Custom headers overriding the browser-like defaults
+        timeout (int, optional): Request timeout in seconds
+        guard (callable, optional): Returns a context manager the page request runs in, an adapter's ``upstream``
+
+    Returns:
+        str: The avatar URL or None
+    """
+    key = request_fingerprint(url, headers, css_selector=css_selector)
+    avatar_url = resolution_cache.get(key)
+    if avatar_url:
+        return avatar_url
+
+    with (guard or nullcontext)():
+        soup, _ = get_html(url, headers, timeout)
+    avatar_url = get_image_from_selector(soup, css_selector)
+    resolution_cache.set(key, avatar_url)
+    return avatar_url
+
+
+async def select_avatar_url_async(url, css_selector, headers=None, timeout=10, guard=None):
+    """
+    Async variant of select_avatar_url.
+
+    Args:
+        url (str): The URL to fetch
+        css_selector (str): CSS selector for the image element
+        headers (dict, optional): Custom headers overriding the browser-like defaults
+        timeout (int, optional): Request timeout in seconds
+        guard (callable, optional): Returns a context manager the page request runs in, an adapter's ``upstream``
+
+    Returns:
+        str: The avatar URL or None
+    """
+    key = request_fingerprint(url, headers, css_selector=css_selector)
+    avatar_url = resolution_cache.get(key)
+    if avatar_url:
+        return avatar_url
+
+    async with (guard or _unguarded)():
+        soup, _ = await get_html_async(url, headers, timeout)
+    avatar_url = get_image_from_selector(soup, css_selector)
+    resolution_cache.set(key, avatar_url)
+    return avatar_url
+
+
 def get_meta_content(soup, property_name):
     """
     Get content from a meta tag with the specified property.
@@ -86,20 +508,7 @@ def get_image_from_selector(soup, selector):
 
     element = soup.select_one(selector)
     if element:
-        # Try to get src attribute first, then srcset if available
-        src = element.get("src")
-        if src:
-            return src
-
-        srcset = element.get("srcset")
-        if srcset:
-            # Get the highest resolution image from srcset
-            parts = srcset.split(",")
-            if parts:
-                # Get the last part which typically has the highest resolution
-                last_part = parts[-1].strip()
-                # Extract the URL from the srcset format
-                url = last_part.split(" ")[0]
-                return url
+        # Try to get src attribute first, then the highest resolution srcset entry
+        return _image_url(element.get("src"), element.get("srcset"))
 
     return None
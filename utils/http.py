@@ -0,0 +1,421 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_async_client = None
+_async_client_loop = None
+
+CHUNK_SIZE = 64 * 1024
+
+# Upstream statuses that mean we are being rate limited or blocked
+BLOCKED_STATUSES = (403, 429)
+
+# Cache validators kept from image responses, by field name and response header
+VALIDATORS = {"etag": "ETag", "last_modified": "Last-Modified"}
+
+
+class UpstreamError(Exception):
+    """
+    An upstream failure that is not about the requested user: a block, a rate limit or a timeout.
+
+    Providers let it propagate instead of reporting "not found", so callers can
+    tell the failure classes apart.
+
+    Attributes:
+        status_code (int): 429 when blocked or rate limited, 503 when the connection failed, 504 on timeout
+    """
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UpstreamRejected(UpstreamError):
+    """
+    An upstream call our own circuit breaker or rate limiter kept from being made.
+    """
+
+    def __init__(self, message):
+        super().__init__(503, message)
+
+
+@contextmanager
+def _upstream_errors(url):
+    """Translate client timeouts and connection failures into UpstreamError."""
+    host = urlparse(url).netloc
+    try:
+        yield
+    except (requests.Timeout, httpx.TimeoutException) as e:
+        raise UpstreamError(504, f"Timed out fetching from {host}") from e
+    except (requests.ConnectionError, httpx.TransportError) as e:
+        raise UpstreamError(503, f"Could not connect to {host}") from e
+
+
+def _check_blocked(url, status_code):
+    """Raise UpstreamError if the upstream refused to serve us."""
+    if status_code in BLOCKED_STATUSES:
+        raise UpstreamError(429, f"{urlparse(url).netloc} refused the request with status {status_code}")
+
+
+def get_session():
+    """
+    Get the shared HTTP session of this worker process.
+
+    The session keeps per-host connection pools alive between requests, so
+    repeated fetches from the same host skip the TCP and TLS handshakes. A
+    new session is created after a fork, sockets must not be shared with
+    the parent process.
+
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session, _session_pid
+
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=Config.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_pid = session, os.getpid()
+
+    return _session
+
+
+def http_get(url, headers=None, timeout=10, **kwargs):
+    """
+    Send a GET request through the shared session.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        **kwargs: Extra arguments for requests.Session.get
+
+    Returns:
+        requests.Response: The response
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    with _upstream_errors(url):
+        response = get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+
+    _check_blocked(url, response.status_code)
+    return response
+
+
+@contextmanager
+def http_stream(url, headers=None, timeout=10):
+    """
+    Send a streamed GET request through the shared session.
+
+    The body is read by the caller; leaving the block before the end closes
+    the connection instead of draining the rest.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+
+    Yields:
+        requests.Response: The response, its body not read yet
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    with _upstream_errors(url), get_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        _check_blocked(url, response.status_code)
+        yield response
+
+
+def _declared_length(headers):
+    """Get the Content-Length of a response, or None if it is missing or invalid."""
+    try:
+        return int(headers["Content-Length"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_validators(headers):
+    """
+    Get the cache validators of a response.
+
+    Args:
+        headers (Mapping): The response headers
+
+    Returns:
+        dict: The ``VALIDATORS`` fields the upstream sent
+    """
+    return {field: headers[header] for field, header in VALIDATORS.items() if headers.get(header)}
+
+
+def _conditional_headers(headers, validators):
+    """Add the If-None-Match and If-Modified-Since headers matching the validators of a previous response."""
+    headers = dict(headers or {})
+    if validators and validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators and validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def download(url, headers=None, timeout=10, max_bytes=None):
+    """
+    Stream a response body in chunks, giving up as soon as it exceeds ``max_bytes``.
+
+    The chunks are joined once at the end; the returned bytes object is
+    shared as-is by the client response and the cache.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        max_bytes (int, optional): Largest accepted body, defaults to AVATAR_MAX_BYTES
+
+    Returns:
+        bytes: The body, or None if the status is not 200 or the body is too large
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    body, _, _ = conditional_download(url, headers=headers, timeout=timeout, max_bytes=max_bytes)
+    return body
+
+
+def conditional_download(url, validators=None, headers=None, timeout=10, max_bytes=None):
+    """
+    Download a body unless it did not change since the response the validators come from.
+
+    Args:
+        url (str): The URL to fetch
+        validators (dict, optional): ``etag`` and ``last_modified`` of the previous response
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        max_bytes (int, optional): Largest accepted body, defaults to AVATAR_MAX_BYTES
+
+    Returns:
+        tuple: (body, validators, not_modified)
+            - body: The body, or None if not modified, the status is not 200 or the body is too large
+            - validators: The validators of this response
+            - not_modified: True if the upstream answered 304 Not Modified
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    max_bytes = max_bytes or Config.AVATAR_MAX_BYTES
+    headers = _conditional_headers(headers, validators)
+
+    with http_stream(url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None, get_validators(response.headers), True
+
+        if response.status_code != 200:
+            return None, {}, False
+
+        length = _declared_length(response.headers)
+        if length is not None and length > max_bytes:
+            return None, {}, False
+
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                # Closing the response drops the connection instead of draining the rest
+                return None, {}, False
+            chunks.append(chunk)
+
+        return b"".join(chunks), get_validators(response.headers), False
+
+
+def get_async_client():
+    """
+    Get the shared async HTTP client of the running event loop.
+
+    Like the sync session, it keeps connections alive between requests. It
+    is bound to the loop it was created in, so a new one is created if the
+    loop changes.
+
+    Returns:
+        httpx.AsyncClient: The shared client
+    """
+    global _async_client, _async_client_loop
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        limits = httpx.Limits(
+            max_connections=Config.ASYNC_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_POOL_CONNECTIONS * Config.HTTP_POOL_MAXSIZE,
+        )
+        # requests follows redirects by default, keep the same behaviour
+        _async_client = httpx.AsyncClient(limits=limits, follow_redirects=True)
+        _async_client_loop = loop
+
+    return _async_client
+
+
+async def async_http_get(url, headers=None, timeout=10, **kwargs):
+    """
+    Send a GET request through the shared async client.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        **kwargs: Extra arguments for httpx.AsyncClient.get
+
+    Returns:
+        httpx.Response: The response
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    with _upstream_errors(url):
+        response = await get_async_client().get(url, headers=headers, timeout=timeout, **kwargs)
+
+    _check_blocked(url, response.status_code)
+    return response
+
+
+@asynccontextmanager
+async def async_http_stream(url, headers=None, timeout=10):
+    """
+    Async variant of http_stream.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+
+    Yields:
+        httpx.Response: The response, its body not read yet
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    with _upstream_errors(url):
+        async with get_async_client().stream("GET", url, headers=headers, timeout=timeout) as response:
+            _check_blocked(url, response.status_code)
+            yield response
+
+
+async def async_download(url, headers=None, timeout=10, max_bytes=None):
+    """
+    Async variant of download.
+
+    Args:
+        url (str): The URL to fetch
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        max_bytes (int, optional): Largest accepted body, defaults to AVATAR_MAX_BYTES
+
+    Returns:
+        bytes: The body, or None if the status is not 200 or the body is too large
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    body, _, _ = await async_conditional_download(url, headers=headers, timeout=timeout, max_bytes=max_bytes)
+    return body
+
+
+async def async_conditional_download(url, validators=None, headers=None, timeout=10, max_bytes=None):
+    """
+    Async variant of conditional_download.
+
+    Args:
+        url (str): The URL to fetch
+        validators (dict, optional): ``etag`` and ``last_modified`` of the previous response
+        headers (dict, optional): Request headers
+        timeout (float, optional): Request timeout in seconds
+        max_bytes (int, optional): Largest accepted body, defaults to AVATAR_MAX_BYTES
+
+    Returns:
+        tuple: (body, validators, not_modified)
+
+    Raises:
+        UpstreamError: If the upstream blocks us, times out or cannot be reached
+    """
+    max_bytes = max_bytes or Config.AVATAR_MAX_BYTES
+    headers = _conditional_headers(headers, validators)
+
+    async with async_http_stream(url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304:
+            return None, get_validators(response.headers), True
+
+        if response.status_code != 200:
+            return None, {}, False
+
+        length = _declared_length(response.headers)
+        if length is not None and length > max_bytes:
+            return None, {}, False
+
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                return None, {}, False
+            chunks.append(chunk)
+
+        return b"".join(chunks), get_validators(response.headers), False
+
+
+async def close_async_client():
+    """Close the shared async client, if one was created."""
+    global _async_client, _async_client_loop
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client, _async_client_loop = None, None
+
+
+def get_pool_stats():
+    """
+    Get connection reuse statistics for every host pool of this worker.
+
+    Returns:
+        dict: Totals plus per-host request, new connection and reuse counts
+    """
+    hosts = {}
+    adapters = {id(adapter): adapter for adapter in get_session().adapters.values()}
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "requests": pool.num_requests,
+                "new_connections": pool.num_connections,
+                "reused_connections": max(pool.num_requests - pool.num_connections, 0),
+                # The pool queue is pre-filled with None placeholders
+                "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+            }
+
+    return {
+        "requests": sum(host["requests"] for host in hosts.values()),
+        "new_connections": sum(host["new_connections"] for host in hosts.values()),
+        "reused_connections": sum(host["reused_connections"] for host in hosts.values()),
+        "hosts": hosts,
+    }
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+from config import Config
+
+# Take an in-flight slot and a token atomically.
+# Returns 0 when both were taken, -1 when no slot is free, or the milliseconds until a token is available.
+ACQUIRE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rate, burst, max_in_flight, lease = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+
+if max_in_flight > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+    if redis.call('ZCARD', KEYS[2]) >= max_in_flight then
+        return -1
+    end
+end
+
+if rate > 0 then
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+    if tokens < 1 then
+        return math.ceil((1 - tokens) * 1000 / rate)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+end
+
+if max_in_flight > 0 then
+    redis.call('ZADD', KEYS[2], now + lease, ARGV[5])
+    redis.call('PEXPIRE', KEYS[2], lease)
+end
+return 0
+"""
+
+# Seconds between checks for a free in-flight slot
+SLOT_POLL_INTERVAL = 0.05
+
+# Cross-worker slots are leased, so a worker that dies mid-fetch cannot hold one forever.
+# A slot covers one URL lookup or image download, at most a page and an image request
+# (lookups with the image included) each bounded by AVATAR_TIMEOUT.
+SLOT_LEASE = 2 * Config.AVATAR_TIMEOUT + 1000
+
+_redis_client = None
+_get_async_redis = None
+
+
+def configure_rate_limits(redis_client=None, get_async_redis=None):
+    """
+    Enforce rate limits across workers through Redis.
+
+    Without a client, or when Redis fails, limits are enforced per worker.
+
+    Args:
+        redis_client (redis.Redis, optional): Client for the sync providers
+        get_async_redis (callable, optional): Returns the asyncio Redis client of the running loop
+    """
+    global _redis_client, _get_async_redis
+    _redis_client = redis_client
+    _get_async_redis = get_async_redis
+
+
+class RateLimiter:
+    """
+    Token bucket and in-flight cap for the upstream lookups of one service.
+
+    Every lookup, a URL resolution or an image download, needs a free
+    in-flight slot and a token. Tokens refill at
+    ``rate`` per second up to ``burst``. When the limit is reached, callers
+    wait up to ``RATE_LIMIT_MAX_WAIT`` with the "queue" policy, or are
+    rejected at once with the "fail" policy.
+    """
+
+    def __init__(self, name, rate=None, burst=None, max_in_flight=None):
+        """
+        Initialize the limiter.
+
+        Args:
+            name (str): The service name
+            rate (float, optional): Lookups per second, None for no rate limit
+            burst (int, optional): Lookups allowed at once after an idle period, defaults to ``rate``
+            max_in_flight (int, optional): Concurrent lookups, None for no cap
+        """
+        self.name = name
+        self.rate = rate or 0
+        self.burst = burst or max(1, int(self.rate))
+        self.max_in_flight = max_in_flight or 0
+        self.enabled = bool(self.rate or self.max_in_flight)
+        self.bucket_key = f"wisp:ratelimit:{name}:bucket"
+        self.slots_key = f"wisp:ratelimit:{name}:slots"
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.stats = {"acquired": 0, "queued": 0, "rejected": 0}
+        self.lock = threading.Lock()
+
+    def _reset_lock(self):
+        """Replace the lock in a forked child, it may have been held at fork time."""
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def _try_local(self):
+        """Take a slot and a token in this worker, see ACQUIRE_SCRIPT for the return value."""
+        with self.lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return -1
+
+            if self.rate:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                self.refilled_at = now
+                if self.tokens < 1:
+                    return (1 - self.tokens) * 1000 / self.rate
+                self.tokens -= 1
+
+            self.in_flight += 1
+            return 0
+
+    def _script_args(self, token):
+        """Get the keys and arguments of ACQUIRE_SCRIPT."""
+        return [self.bucket_key, self.slots_key], [self.rate, self.burst, self.max_in_flight, SLOT_LEASE, token]
+
+    def _try(self, token):
+        """Take a slot and a token across workers, falling back to this worker if Redis fails."""
+        if _redis_client is None:
+            return self._try_local()
+
+        keys, args = self._script_args(token)
+        try:
+            return _redis_client.eval(ACQUIRE_SCRIPT, len(keys), *keys, *args)
+        except redis.RedisError:
+            return self._try_local()
+
+    async def _try_async(self, token):
+        """Async variant of _try."""
+        if _get_async_redis is None:
+            return self._try_local()
+
+        keys, args = self._script_args(token)
+        try:
+            return await _get_async_redis().eval(ACQUIRE_SCRIPT, len(keys), *keys, *args)
+        except redis.RedisError:
+            return self._try_local()
+
+    def _delay(self, wait, deadline):
+        """
+        Get how long to sleep before the next attempt.
+
+        Args:
+            wait (float): Result of a failed attempt
+            deadline (float): Monotonic time after which the caller is rejected
+
+        Returns:
+            float: Seconds to sleep, or None if the caller should be rejected
+        """
+        delay = SLOT_POLL_INTERVAL if wait < 0 else wait / 1000
+        if Config.RATE_LIMIT_POLICY == "fail" or time.monotonic() + delay > deadline:
+            return None
+        return delay
+
+    def _count(self, outcome, queued):
+        """Count the outcome of an acquire."""
+        with self.lock:
+            self.stats[outcome] += 1
+            if queued:
+                self.stats["queued"] += 1
+
+    def acquire(self):
+        """
+        Wait for a slot and a token according to the configured policy.
+
+        Returns:
+            tuple: (acquired, token), pass the token to ``release`` once the lookup is done
+        """
+        if not self.enabled:
+            return True, None
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + Config.RATE_LIMIT_MAX_WAIT / 1000
+        queued = False
+
+        while True:
+            wait = self._try(token)
+            if wait == 0:
+                self._count("acquired", queued)
+                return True, token
+
+            delay = self._delay(wait, deadline)
+            if delay is None:
+                self._count("rejected", queued)
+                return False, None
+
+            queued = True
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """
+        Async variant of acquire.
+
+        Returns:
+            tuple: (acquired, token), pass the token to ``release_async`` once the lookup is done
+        """
+        if not self.enabled:
+            return True, None
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + Config.RATE_LIMIT_MAX_WAIT / 1000
+        queued = False
+
+        while True:
+            wait = await self._try_async(token)
+            if wait == 0:
+                self._count("acquired", queued)
+                return True, token
+
+            delay = self._delay(wait, deadline)
+            if delay is None:
+                self._count("rejected", queued)
+                return False, None
+
+            queued = True
+            await asyncio.sleep(delay)
+
+    def _release_local(self):
+        """Free a slot taken in this worker."""
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def release(self, token):
+        """
+        Free the in-flight slot of a finished lookup.
+
+        Args:
+            token (str): The token returned by ``acquire``
+        """
+        if token is None or not self.max_in_flight:
+            return
+
+        if _redis_client is None:
+            self._release_local()
+            return
+
+        try:
+            # A slot taken locally after a Redis failure is not in the set, free it locally instead
+            if not _redis_client.zrem(self.slots_key, token):
+                self._release_local()
+        except redis.RedisError:
+            self._release_local()
+
+    async def release_async(self, token):
+        """
+        Async variant of release.
+
+        Args:
+            token (str): The token returned by ``acquire_async``
+        """
+        if token is None or not self.max_in_flight:
+            return
+
+        if _get_async_redis is None:
+            self._release_local()
+            return
+
+        try:
+            if not await _get_async_redis().zrem(self.slots_key, token):
+                self._release_local()
+        except redis.RedisError:
+            self._release_local()
+
+    def get_stats(self):
+        """
+        Get the limits and this worker's counters.
+
+        Returns:
+            dict: Configured limits, acquired, queued and rejected lookups
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        return {"rate": self.rate, "burst": self.burst, "max_in_flight": self.max_in_flight, **stats}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _reset_limiters_lock():
+    """Replace the registry lock and limiter locks in a forked child."""
+    global _limiters_lock
+    _limiters_lock = threading.Lock()
+    for limiter in _limiters.values():
+        limiter._reset_lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_limiters_lock)
+
+
+def get_limiter(provider):
+    """
+    Get the rate limiter of a service, created from its adapter's limits on first use.
+
+    Args:
+        provider (AvatarProvider): The service adapter, declaring ``rate_limit``,
+            ``rate_burst`` and ``max_in_flight``
+
+    Returns:
+        RateLimiter: The limiter shared by every adapter instance of the service
+    """
+    limiter = _limiters.get(provider.name)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider.name)
+            if limiter is None:
+                limiter = _limiters[provider.name] = RateLimiter(
+                    provider.name, provider.rate_limit, provider.rate_burst, provider.max_in_flight
+                )
+    return limiter
+
+
+def get_rate_limit_stats():
+    """
+    Get the limits and counters of every service limited in this worker.
+
+    Returns:
+        dict: Limiter statistics by service name
+    """
+    return {name: limiter.get_stats() for name, limiter in sorted(_limiters.items()) if limiter.enabled}
@@ -1,10 +1,16 @@
-import io
+import hashlib
 import os
+import time
+from datetime import datetime
 
-from flask import jsonify, request, send_file
+from flask import Response, jsonify, request, send_file
 
+from cache.utils import detect_content_type, get_ttl
 
-def format_response(username, service, image_data, image_url, cache_metadata=None, raw=False):
+
+def format_response(
+    username, service, image_data, image_url, cache_metadata=None, raw=False, ttl=None, image_hash=None
+):
     """
     Format the response based on the raw parameter.
     If raw is True, return JSON data, otherwise return the image.
@@ -12,16 +18,45 @@ def format_response(username, service, image_data, image_url, cache_metadata=Non
     if raw:
         return format_json_response(username, service, image_url, cache_metadata)
     else:
-        return format_image_response(image_data, image_url, username)
+        return format_image_response(image_data, image_url, username, cache_metadata, ttl, image_hash)
+
+
+def get_max_age(cache_metadata=None, ttl=None):
+    """
+    Get how long clients may reuse an image without asking again.
+
+    Args:
+        cache_metadata (dict, optional): Metadata of the cache entry the image was served from
+        ttl (int, optional): Custom TTL in seconds, for images that were just fetched
 
+    Returns:
+        int: The seconds left before the cache entry expires, 0 if it is stale
+    """
+    if not cache_metadata:
+        return get_ttl(ttl)
+
+    if cache_metadata.get("status") == "stale":
+        return 0
+
+    remaining = datetime.fromisoformat(cache_metadata["expires_at"]).timestamp() - time.time()
+    return max(0, int(remaining))
 
-def format_image_response(image_data, image_url=None, username=None):
+
+def format_image_response(image_data, image_url=None, username=None, cache_metadata=None, ttl=None, image_hash=None):
     """
     Return the image data as a response.
+
+    The response carries a strong ETag from the image's content hash and a
+    Cache-Control max-age matching its cache entry, and becomes a 304 Not
+    Modified when the client's If-None-Match already has the image.
     """
     if image_data:
-        # Return the image data
-        return send_file(io.BytesIO(image_data), mimetype="image/jpeg")
+        # Hand the buffer to the response as-is, wrapping it in a file object would copy it
+        response = Response(image_data, mimetype=detect_content_type(image_data))
+        response.set_etag(image_hash or hashlib.sha256(image_data).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = get_max_age(cache_metadata, ttl)
+        return response.make_conditional(request)
 
     return format_default_avatar_response()
 
@@ -38,7 +73,7 @@ def format_json_response(username, service, image_url, cache_metadata=None):
 
     if cache_metadata:
         response_data["cache"] = {
-            "status": "hit",
+            "status": cache_metadata.get("status", "hit"),
             "created_at": cache_metadata.get("created_at"),
             "expires_at": cache_metadata.get("expires_at"),
             "ttl": cache_metadata.get("ttl"),
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+from config import Config
+
+# Delete the lock only if it still holds our token, it may have expired and been taken over
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Call:
+    """An upstream fetch in progress in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent fetches of the same key into one call.
+
+    Within a process the first caller for a key runs the fetch and the others
+    wait for its result. With a Redis client, the running caller also holds a
+    short ``SET NX PX`` lock so callers in other workers poll the cache for the
+    result instead of fetching the same key themselves.
+    """
+
+    def __init__(self, redis_client=None, lock_ttl=None, poll_interval=None):
+        """
+        Initialize the coalescer.
+
+        Args:
+            redis_client (redis.Redis, optional): Client for cross-worker locks
+            lock_ttl (int, optional): Lock lifetime in milliseconds
+            poll_interval (int, optional): Milliseconds between cache checks while another worker fetches
+        """
+        self.redis = redis_client
+        self.lock_ttl = lock_ttl or Config.SINGLEFLIGHT_LOCK_TTL
+        self.poll_interval = (poll_interval or Config.SINGLEFLIGHT_POLL_INTERVAL) / 1000
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT) if self.redis is not None else None
+        self.lock_prefix = "wisp:lock:"
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "remote_waits": 0}
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        """Forget fetches that were in progress in the parent process."""
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, check=None):
+        """
+        Run ``func`` for a key unless a fetch for it is already running.
+
+        Args:
+            key (str): The key to coalesce on
+            func (callable): Fetches the result, and stores it where ``check`` can see it
+            check (callable, optional): Returns the stored result or None, used while
+                another worker holds the lock
+
+        Returns:
+            The result of ``func``, shared by all callers for the key
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+
+        if not leader:
+            if not call.done.wait(self.lock_ttl / 1000):
+                # The fetch is stuck, do not wait for it any longer
+                return func()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, func, check)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+
+    def _run(self, key, func, check):
+        """Run ``func`` under the cross-worker lock, or wait for the worker holding it."""
+        if self.redis is None or check is None:
+            return func()
+
+        lock_key = f"{self.lock_prefix}{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl / 1000
+
+        while True:
+            try:
+                acquired = self.redis.set(lock_key, token, nx=True, px=self.lock_ttl)
+            except redis.RedisError:
+                return func()
+
+            if acquired:
+                try:
+                    return func()
+                finally:
+                    try:
+                        self.release_script(keys=[lock_key], args=[token])
+                    except redis.RedisError:
+                        pass
+
+            with self.lock:
+                self.stats["remote_waits"] += 1
+
+            time.sleep(self.poll_interval)
+            result = check()
+            if result is not None:
+                return result
+
+            if time.monotonic() >= deadline:
+                return func()
+
+    def get_stats(self):
+        """
+        Get coalescing statistics for this worker.
+
+        Returns:
+            dict: Fetches run (leaders), callers that waited in process (followers)
+                and polls while another worker held the lock (remote_waits)
+        """
+        with self.lock:
+            stats = dict(self.stats)
+        stats["in_flight"] = len(self.calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """
+    asyncio variant of SingleFlight for the ASGI entry point.
+
+    The fetch runs in its own task, so a caller that disconnects does not
+    cancel it for the callers still waiting on the same key.
+    """
+
+    def __init__(self, get_redis=None, lock_ttl=None, poll_interval=None):
+        """
+        Initialize the coalescer.
+
+        Args:
+            get_redis (callable, optional): Returns the asyncio Redis client of the running loop
+            lock_ttl (int, optional): Lock lifetime in milliseconds
+            poll_interval (int, optional): Milliseconds between cache checks while another worker fetches
+        """
+        self.get_redis = get_redis
+        self.lock_ttl = lock_ttl or Config.SINGLEFLIGHT_LOCK_TTL
+        self.poll_interval = (poll_interval or Config.SINGLEFLIGHT_POLL_INTERVAL) / 1000
+        self.lock_prefix = "wisp:lock:"
+        self.calls = {}
+        self.stats = {"leaders": 0, "followers": 0, "remote_waits": 0}
+
+    async def do(self, key, func, check=None):
+        """
+        Await ``func`` for a key unless a fetch for it is already running.
+
+        Args:
+            key (str): The key to coalesce on
+            func (callable): Coroutine function that fetches and stores the result
+            check (callable, optional): Coroutine function returning the stored result or None
+
+        Returns:
+            The result of ``func``, shared by all callers for the key
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(key, func, check))
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["followers"] += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.lock_ttl / 1000)
+        except asyncio.TimeoutError:
+            # The fetch is stuck, do not wait for it any longer
+            return await func()
+
+    def _finish(self, key, task):
+        """Forget a finished fetch, marking its exception as retrieved."""
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _run(self, key, func, check):
+        """Await ``func`` under the cross-worker lock, or wait for the worker holding it."""
+        if self.get_redis is None or check is None:
+            return await func()
+
+        client = self.get_redis()
+        lock_key = f"{self.lock_prefix}{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_ttl / 1000
+
+        while True:
+            try:
+                acquired = await client.set(lock_key, token, nx=True, px=self.lock_ttl)
+            except redis.RedisError:
+                return await func()
+
+            if acquired:
+                try:
+                    return await func()
+                finally:
+                    try:
+                        await client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+                    except redis.RedisError:
+                        pass
+
+            self.stats["remote_waits"] += 1
+
+            await asyncio.sleep(self.poll_interval)
+            result = await check()
+            if result is not None:
+                return result
+
+            if time.monotonic() >= deadline:
+                return await func()
+
+    def get_stats(self):
+        """
+        Get coalescing statistics for this worker.
+
+        Returns:
+            dict: Same counters as SingleFlight.get_stats
+        """
+        return {**self.stats, "in_flight": len(self.calls)}